@@ -0,0 +1,117 @@
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 调用录制/回放模式：off（默认，直接调用）、record（调用并录制）、replay（只从本地回放，不联网）
+CASSETTE_MODE = os.getenv("PROVIDER_CASSETTE", "off").lower()
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cassettes"))
+# 回放时的模拟延迟：0（默认，不等待）、recorded（按录制时的真实耗时）或秒数
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "0")
+# strict：只按请求指纹匹配；loose（默认）：指纹未命中时按录制顺序回放同类请求
+# （planner 的 prompt 含日期和随机选择的风格/IP，跨天回放需要 loose）
+CASSETTE_MATCH = os.getenv("CASSETTE_MATCH", "loose").lower()
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when no recorded interaction matches a request."""
+
+_used = set()
+# find + mark-used must be atomic, or concurrent replays can be handed the same loose match
+_used_lock = threading.Lock()
+
+def fingerprint(kind, request):
+    payload = json.dumps({"kind": kind, "request": request}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+def _entry_path(kind, fp):
+    return os.path.join(CASSETTE_DIR, kind, f"{fp}.json.gz")
+
+def _load(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def _find(kind, fp, request, same):
+    path = _entry_path(kind, fp)
+    if os.path.exists(path):
+        return fp, _load(path)
+    if CASSETTE_MATCH == "strict":
+        return None, None
+
+    kind_dir = os.path.join(CASSETTE_DIR, kind)
+    if not os.path.isdir(kind_dir):
+        return None, None
+    entries = []
+    for name in os.listdir(kind_dir):
+        if name.endswith(".json.gz") and (kind, name[:-8]) not in _used:
+            entry = _load(os.path.join(kind_dir, name))
+            # Loose matching may ignore drifting fields, but never the ones listed in `same`
+            if any(entry["request"].get(k) != request.get(k) for k in same):
+                continue
+            entries.append((entry.get("recorded_at", 0), name[:-8], entry))
+    if not entries:
+        return None, None
+    _, fp, entry = min(entries, key=lambda e: (e[0], e[1]))
+    return fp, entry
+
+def recorded_values(kind, key):
+    """Distinct values of request[`key`] across the recorded `kind` interactions."""
+    kind_dir = os.path.join(CASSETTE_DIR, kind)
+    if not os.path.isdir(kind_dir):
+        return set()
+    return {
+        _load(os.path.join(kind_dir, name))["request"].get(key)
+        for name in os.listdir(kind_dir) if name.endswith(".json.gz")
+    }
+
+def _simulate_latency(entry):
+    if CASSETTE_LATENCY == "recorded":
+        delay = entry.get("latency", 0)
+    else:
+        delay = float(CASSETTE_LATENCY or 0)
+    if delay > 0:
+        time.sleep(delay)
+
+def _replay(kind, request, binary, same):
+    with _used_lock:
+        fp, entry = _find(kind, fingerprint(kind, request), request, same)
+        if entry is None:
+            raise CassetteMiss(f"No recorded {kind} interaction for request {fingerprint(kind, request)}")
+        _used.add((kind, fp))
+    _simulate_latency(entry)
+    if binary:
+        with open(os.path.join(CASSETTE_DIR, kind, f"{fp}.bin"), "rb") as f:
+            return f.read()
+    return entry["response"]
+
+def _record(kind, request, response, latency, binary):
+    fp = fingerprint(kind, request)
+    os.makedirs(os.path.join(CASSETTE_DIR, kind), exist_ok=True)
+    entry = {"kind": kind, "request": request, "latency": round(latency, 3), "recorded_at": time.time()}
+    if binary:
+        with open(os.path.join(CASSETTE_DIR, kind, f"{fp}.bin"), "wb") as f:
+            f.write(response)
+    else:
+        entry["response"] = response
+    with gzip.open(_entry_path(kind, fp), "wt", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+
+def cached_call(kind, request, call, binary=False, same=()):
+    """Run `call()` through the cassette store according to PROVIDER_CASSETTE.
+
+    `request` is the JSON-serialisable description used for the fingerprint; `call`
+    returns a JSON-serialisable response, or bytes when `binary` is set. `same` lists
+    request keys a loose replay match must still agree on (e.g. provider and model).
+    """
+    if CASSETTE_MODE == "replay":
+        return _replay(kind, request, binary, same)
+
+    started = time.perf_counter()
+    response = call()
+    if CASSETTE_MODE == "record":
+        _record(kind, request, response, time.perf_counter() - started, binary)
+    return response
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 目标宽高比（宽:高），与 prompt 中的 --ar 保持一致
+CROP_ASPECT = os.getenv("CROP_ASPECT", "3:4")
+# 计算能量图时的缩略图长边像素
+ENERGY_MAX_SIDE = 128
+# 宽高比误差在此范围内视为已符合，不再裁剪
+ASPECT_TOLERANCE = 0.01
+# 居中先验权重：0 为纯能量，越大越倾向居中
+CENTER_BIAS = 0.15
+
+def parse_aspect(value):
+    """'3:4' -> 0.75 (width / height)."""
+    w, h = value.split(":")
+    return float(w) / float(h)
+
+def energy_map(img):
+    """Gradient-magnitude energy of a downsampled grayscale copy, plus a local contrast term."""
+    small = img.convert("L")
+    small.thumbnail((ENERGY_MAX_SIDE, ENERGY_MAX_SIDE))
+    gray = np.asarray(small, dtype=np.float32) / 255.0
+
+    energy = np.zeros_like(gray)
+    energy[:, 1:] += np.abs(np.diff(gray, axis=1))
+    energy[1:, :] += np.abs(np.diff(gray, axis=0))
+    # 与整体亮度差异大的区域（人物、光源）通常是视觉焦点
+    energy += 0.5 * np.abs(gray - gray.mean())
+    return energy
+
+def best_window(energy, aspect):
+    """Return (offset, length, axis, extent) of the max-energy window with the target aspect on the energy grid.
+
+    Only one axis ever needs sliding (the crop keeps the full extent of the other),
+    so the search is a cumulative-sum over a 1-D profile.
+    """
+    h, w = energy.shape
+    if w / h > aspect:
+        axis, extent, length = 1, w, max(1, min(w, round(h * aspect)))
+    else:
+        axis, extent, length = 0, h, max(1, min(h, round(w / aspect)))
+
+    profile = energy.sum(axis=1 - axis)
+    cumsum = np.concatenate(([0.0], np.cumsum(profile)))
+    scores = cumsum[length:] - cumsum[:-length]
+
+    if CENTER_BIAS and len(scores) > 1:
+        positions = np.arange(len(scores))
+        center = (len(scores) - 1) / 2
+        scores = scores * (1.0 - CENTER_BIAS * np.abs(positions - center) / center)
+
+    return int(np.argmax(scores)), length, axis, extent
+
+def smart_crop(path, aspect_label=CROP_ASPECT):
+    """Crop the image at `path` in place to `aspect_label` (e.g. '3:4'); returns the chosen window or None if already matching."""
+    aspect = parse_aspect(aspect_label)
+    with Image.open(path) as img:
+        img.load()
+    width, height = img.size
+    if abs(width / height - aspect) <= ASPECT_TOLERANCE * aspect:
+        return None
+
+    started = time.perf_counter()
+    energy = energy_map(img)
+    offset, length, axis, extent = best_window(energy, aspect)
+
+    # 映射回原图坐标
+    if axis == 1:
+        crop_w = min(width, round(height * aspect))
+        left = min(width - crop_w, round(offset * width / extent))
+        box = (left, 0, left + crop_w, height)
+    else:
+        crop_h = min(height, round(width / aspect))
+        top = min(height - crop_h, round(offset * height / extent))
+        box = (0, top, width, top + crop_h)
+    select_ms = (time.perf_counter() - started) * 1000
+
+    # Write-then-rename so an interrupted crop never leaves a truncated image behind
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.partial{ext}"
+    img.crop(box).save(tmp_path)
+    os.replace(tmp_path, path)
+    return {
+        "source_size": [width, height],
+        "box": list(box),
+        "aspect": aspect_label,
+        "select_ms": round(select_ms, 2),
+    }
+
+def crop_day(work_dir, workers=None):
+    """Smart-crop every N.png in `work_dir` in a process pool and record the windows in meta.json."""
+    names = sorted(
+        (f for f in os.listdir(work_dir) if f.endswith(".png") and f[:-4].isdigit()),
+        key=lambda f: int(f[:-4])
+    )
+    if not names:
+        return {}
+
+    paths = [os.path.join(work_dir, f) for f in names]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(smart_crop, paths))
+
+    crops = {name: result for name, result in zip(names, results) if result}
+    for name, result in crops.items():
+        print(f"✂️  {name}: {result['source_size'][0]}x{result['source_size'][1]} -> box {result['box']} ({result['select_ms']:.1f}ms)")
+
+    record_crops(work_dir, crops)
+    return crops
+
+def record_crops(work_dir, crops):
+    """Merge {"N.png": window} into the "crops" field of the day's meta.json."""
+    if not crops:
+        return
+    meta_path = os.path.join(work_dir, "meta.json")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta.setdefault("crops", {}).update(crops)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
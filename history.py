@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import time
+import datetime
+import numpy as np
+
+# 字符 n-gram 长度与哈希向量维度
+NGRAM = 3
+VECTOR_DIM = 2048
+# 解析后的历史索引缓存（按 meta.json 的 mtime/大小增量更新）；n-gram 哈希方式变化时需递增 INDEX_VERSION
+HISTORY_INDEX_PATH = os.getenv("HISTORY_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".prompt_history.npz"))
+INDEX_VERSION = 2
+
+# 去掉每条 prompt 都会有的风格权重、比例后缀和通用质量词，避免它们主导相似度
+_WEIGHT_RE = re.compile(r"\([^()]*:\s*\d+(\.\d+)?\)")
+_AR_RE = re.compile(r"--ar\s*\d+:\d+")
+BOILERPLATE = [
+    "masterpiece", "8k wallpaper quality", "highly detailed", "hyper-detailed", "best quality",
+    "cinematic lighting", "cinematic composition", "atmospheric", "photorealistic",
+]
+
+def normalize(text):
+    text = _AR_RE.sub(" ", _WEIGHT_RE.sub(" ", text.lower()))
+    for phrase in BOILERPLATE:
+        text = text.replace(phrase, " ")
+    return re.sub(r"[\s,.，。、]+", " ", text).strip()
+
+def _ngram_buckets(text):
+    """Bucket id of every character n-gram, hashed in one vectorised pass over the code points."""
+    codes = np.frombuffer(normalize(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < NGRAM:
+        codes = np.pad(codes, (0, NGRAM - len(codes)))
+    count = len(codes) - NGRAM + 1
+    grams = np.zeros(count, dtype=np.uint64)
+    for i in range(NGRAM):
+        grams = grams * np.uint64(1000003) + codes[i:i + count]
+    # Fibonacci hashing spreads neighbouring code points across buckets
+    return ((grams * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)).astype(np.int64) % VECTOR_DIM
+
+def _terms(text):
+    """Sparse term counts: (bucket ids, counts). Never empty, since every text yields at least one gram."""
+    buckets, counts = np.unique(_ngram_buckets(text), return_counts=True)
+    return buckets.astype(np.int16), counts.astype(np.float32)
+
+# 只缓存选题轮换和标题回避用到的字段
+META_FIELDS = ("title", "theme", "content", "tags", "style_name", "ip")
+
+def _read_index(path):
+    """{date: {"stamp", "meta", "entries": [(entry, terms)]}} from the on-disk index, or {} if unusable."""
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            catalog = json.loads(str(npz["catalog"]))
+            if catalog.get("version") != INDEX_VERSION:
+                return {}
+            indptr, indices, counts = npz["indptr"], npz["indices"], npz["counts"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    days = {}
+    for row, (date, stamp, meta, entry) in enumerate(catalog["rows"]):
+        day = days.setdefault(date, {"stamp": stamp, "meta": meta, "entries": []})
+        if entry is not None:
+            lo, hi = indptr[row], indptr[row + 1]
+            day["entries"].append((entry, (indices[lo:hi], counts[lo:hi])))
+    return days
+
+def _write_index(path, days):
+    rows, indptr, indices, counts = [], [0], [], []
+    for date, day in sorted(days.items()):
+        # A day without entries still needs a row so its meta and stamp survive
+        for entry, terms in day["entries"] or [(None, (np.zeros(0, np.int16), np.zeros(0, np.float32)))]:
+            rows.append((date, day["stamp"], day["meta"], entry))
+            indices.append(terms[0])
+            counts.append(terms[1])
+            indptr.append(indptr[-1] + len(terms[0]))
+    try:
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                catalog=np.array(json.dumps({"version": INDEX_VERSION, "rows": rows}, ensure_ascii=False)),
+                indptr=np.array(indptr, dtype=np.int64),
+                indices=np.concatenate(indices) if indices else np.zeros(0, np.int16),
+                counts=np.concatenate(counts) if counts else np.zeros(0, np.float32),
+            )
+    except OSError as e:
+        print(f"History index save failed: {e}")
+
+class PromptHistory:
+    """TF-IDF weighted, hashed character n-gram vectors of past image prompts and titles.
+
+    Each kind is kept as a dense, L2-normalised float32 matrix laid out bucket-major with
+    rows in date order, so a lookup is a binary search for the window start, a copy of
+    just the buckets the queries use (contiguous runs) and one small GEMM.
+    """
+
+    def __init__(self, entries, metas=None, terms=None):
+        self.entries = entries
+        self.metas = metas or []
+        terms = terms if terms is not None else [_terms(e["text"]) for e in entries]
+        df = np.bincount(np.concatenate([t[0] for t in terms]).astype(np.int64), minlength=VECTOR_DIM) if terms else np.zeros(VECTOR_DIM)
+        self.idf = (np.log((len(entries) + 1) / (df + 1)) + 1).astype(np.float32)
+        self.dates = np.array([e["date"] for e in entries])
+        self.kinds = np.array([e["kind"] for e in entries])
+        self.last_lookup_ms = None
+
+        self._index = {}
+        for kind in set(self.kinds.tolist()):
+            rows = np.flatnonzero(self.kinds == kind)
+            rows = rows[np.argsort(self.dates[rows], kind="stable")]
+            lengths = [len(terms[r][0]) for r in rows]
+            matrix = np.zeros((VECTOR_DIM, len(rows)), dtype=np.float32)
+            matrix[np.concatenate([terms[r][0] for r in rows]).astype(np.intp), np.repeat(np.arange(len(rows)), lengths)] = np.concatenate([terms[r][1] for r in rows])
+            matrix *= self.idf[:, None]
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=0), 1e-8)
+            self._index[kind] = (rows, self.dates[rows], matrix)
+
+    def _queries(self, texts):
+        counts = np.stack([np.bincount(_ngram_buckets(t), minlength=VECTOR_DIM) for t in texts])
+        query = counts.astype(np.float32) * self.idf
+        return query / np.maximum(np.linalg.norm(query, axis=1, keepdims=True), 1e-8)
+
+    @classmethod
+    def load(cls, content_root="content", exclude_date=None, index_path=HISTORY_INDEX_PATH):
+        """Index every content/<date>/meta.json except `exclude_date`.
+
+        Parsed days are kept in an on-disk index keyed by meta.json mtime/size, so only
+        new or changed days are re-read and re-tokenised.
+        """
+        cached = _read_index(index_path) if index_path else {}
+        days = {}
+        if os.path.isdir(content_root):
+            for date in sorted(os.listdir(content_root)):
+                meta_path = os.path.join(content_root, date, "meta.json")
+                try:
+                    st = os.stat(meta_path)
+                except OSError:
+                    continue
+                stamp = [st.st_mtime_ns, st.st_size]
+                if date in cached and cached[date]["stamp"] == stamp:
+                    days[date] = cached[date]
+                    continue
+                try:
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        meta = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                texts = [("title", meta["title"])] if meta.get("title") else []
+                texts += [("prompt", p) for p in meta.get("image_prompts", []) if isinstance(p, str)]
+                days[date] = {
+                    "stamp": stamp,
+                    "meta": {k: meta[k] for k in META_FIELDS if k in meta},
+                    "entries": [({"date": date, "kind": kind, "text": text}, _terms(text)) for kind, text in texts],
+                }
+        if index_path and (days.keys() != cached.keys() or any(days[d] is not cached.get(d) for d in days)):
+            _write_index(index_path, days)
+
+        entries, terms, metas = [], [], []
+        for date, day in sorted(days.items()):
+            if date == exclude_date:
+                continue
+            metas.append((date, day["meta"]))
+            for entry, entry_terms in day["entries"]:
+                entries.append(entry)
+                terms.append(entry_terms)
+        return cls(entries, metas, terms)
+
+    def similarities(self, texts, kind="prompt", days=None, today=None):
+        """Return (scores, indices) of the closest past entry for each text; -1/-1 when nothing is in the window."""
+        started = time.perf_counter()
+        scores, best = np.full(len(texts), -1.0), np.full(len(texts), -1)
+        if kind in self._index and len(texts):
+            rows, dates, matrix = self._index[kind]
+            lo = 0
+            if days is not None:
+                since = (datetime.date.fromisoformat(today or datetime.date.today().isoformat()) - datetime.timedelta(days=days)).isoformat()
+                lo = int(np.searchsorted(dates, since))
+            if lo < len(rows):
+                query = self._queries(texts)
+                # Only buckets some query uses can contribute to a dot product
+                used = np.flatnonzero(query.any(axis=0))
+                window = query[:, used] @ matrix[used, lo:]
+                top = window.argmax(axis=1)
+                scores, best = window[np.arange(len(texts)), top], rows[lo + top]
+        self.last_lookup_ms = (time.perf_counter() - started) * 1000
+        return scores, best
+
+    def find_repeats(self, texts, threshold, kind="prompt", days=None, today=None):
+        """Indices of `texts` whose nearest past entry is at least `threshold` cosine-similar,
+        mapped to (score, matched entry)."""
+        scores, best = self.similarities(texts, kind, days, today)
+        return {
+            i: (float(scores[i]), self.entries[best[i]])
+            for i in range(len(texts)) if scores[i] >= threshold
+        }
+
+    def recent_metas(self, days, today=None):
+        since = (datetime.date.fromisoformat(today or datetime.date.today().isoformat()) - datetime.timedelta(days=days)).isoformat()
+        return [(date, meta) for date, meta in self.metas if date >= since]
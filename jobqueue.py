@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 渲染任务队列（SQLite 文件），供同一台机器上的多个 painter worker 进程协作；
+# SQLite 的文件锁在 NFS/SMB 等网络文件系统上不可靠，不要让多台机器共享同一个队列文件
+QUEUE_PATH = os.getenv("RENDER_QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".render_jobs.sqlite"))
+# 租约时长（秒）：worker 需在租约内心跳续期，过期未续的任务会被其他 worker 重新领取
+LEASE_SECONDS = float(os.getenv("RENDER_LEASE_SECONDS", "120"))
+MAX_ATTEMPTS = int(os.getenv("RENDER_MAX_ATTEMPTS", "3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    work_dir TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    prompt TEXT NOT NULL,
+    output_path TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    updated REAL
+)
+"""
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+@contextmanager
+def _connect(path=None):
+    conn = sqlite3.connect(path or QUEUE_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute(SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+@contextmanager
+def _transaction(conn):
+    # IMMEDIATE takes the write lock up front so two workers never claim the same job
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def enqueue_prompts(work_dir, prompts):
+    """Push one job per image prompt; already-rendered images are skipped.
+
+    Re-enqueueing a day (e.g. the planner re-ran) replaces the prompt of its pending,
+    failed or done-but-missing jobs and resets their attempts; running jobs are left alone.
+    """
+    added = 0
+    with _connect() as conn, _transaction(conn):
+        for i, prompt in enumerate(prompts):
+            output_path = os.path.join(work_dir, f"{i+1}.png")
+            if os.path.exists(output_path):
+                continue
+            cursor = conn.execute(
+                """INSERT INTO jobs (work_dir, idx, prompt, output_path, updated) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(output_path) DO UPDATE SET
+                       prompt = excluded.prompt, status = 'pending', attempts = 0, worker = NULL,
+                       lease_until = NULL, result = NULL, error = NULL, updated = excluded.updated
+                   WHERE jobs.status != 'running'""",
+                (work_dir, i + 1, prompt, output_path, time.time())
+            )
+            added += cursor.rowcount
+    return added
+
+def claim(worker):
+    """Lease the oldest pending (or lease-expired) job to `worker`. Returns a dict or None.
+
+    A lease-expired job that is out of attempts is marked failed, unless its image made it
+    to disk (a worker finished after losing the lease): that job is still handed out so the
+    claimer can crop and complete it without rendering again.
+    """
+    now = time.time()
+    with _connect() as conn, _transaction(conn):
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'pending' OR (status = 'running' AND lease_until < ?) ORDER BY id",
+            (now,)
+        ).fetchall()
+        for row in rows:
+            if row["attempts"] >= MAX_ATTEMPTS and not os.path.exists(row["output_path"]):
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'lease expired', lease_until = NULL, updated = ? WHERE id = ?",
+                    (now, row["id"])
+                )
+                continue
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker, now + LEASE_SECONDS, now, row["id"])
+            )
+            return dict(row, attempts=row["attempts"] + 1)
+        return None
+
+def heartbeat(job_id, worker):
+    """Extend the lease; returns False if the job was taken over by another worker."""
+    now = time.time()
+    with _connect() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (now + LEASE_SECONDS, now, job_id, worker)
+        )
+        return cursor.rowcount == 1
+
+def _owned(conn, job_id, worker):
+    """True if `worker` still holds the job; logs who took it over otherwise."""
+    row = conn.execute("SELECT status, worker FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is not None and row["status"] == "running" and row["worker"] == worker:
+        return True
+    state = f"{row['status']} by {row['worker']}" if row is not None else "gone"
+    print(f"⚠️  Job {job_id} is no longer leased to {worker} (now {state}), dropping this result")
+    return False
+
+def complete(job_id, worker, result=None):
+    """Mark a job done. Returns the work_dir's job results once every job of that day is done, else None.
+
+    A worker that lost its lease changes nothing: the job's current holder owns the result
+    (its render is the one that ends up on disk).
+    """
+    with _connect() as conn, _transaction(conn):
+        if not _owned(conn, job_id, worker):
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, lease_until = NULL, updated = ? WHERE id = ?",
+            (json.dumps(result) if result is not None else None, time.time(), job_id)
+        )
+        return _day_results(conn, job_id)
+
+def fail(job_id, worker, error):
+    """Release a failed job for retry, or mark it failed once MAX_ATTEMPTS is reached.
+
+    A job whose image is already on disk (written by a worker that had lost its lease) is
+    marked done instead. Like complete(), returns the day's job results if this was the
+    day's last unfinished job, and changes nothing if `worker` lost the lease.
+    """
+    with _connect() as conn, _transaction(conn):
+        if not _owned(conn, job_id, worker):
+            return None
+        output_path = conn.execute("SELECT output_path FROM jobs WHERE id = ?", (job_id,)).fetchone()["output_path"]
+        conn.execute(
+            """UPDATE jobs SET status = CASE WHEN ? THEN 'done' WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                   error = ?, lease_until = NULL, updated = ?
+               WHERE id = ?""",
+            (os.path.exists(output_path), MAX_ATTEMPTS, str(error), time.time(), job_id)
+        )
+        return _day_results(conn, job_id)
+
+def _day_results(conn, job_id):
+    """{idx: result} for the job's work_dir once every job of that day is done or failed, else None."""
+    work_dir = conn.execute("SELECT work_dir FROM jobs WHERE id = ?", (job_id,)).fetchone()["work_dir"]
+    rows = conn.execute("SELECT idx, status, result FROM jobs WHERE work_dir = ?", (work_dir,)).fetchall()
+    if any(r["status"] not in ("done", "failed") for r in rows):
+        return None
+    return {r["idx"]: json.loads(r["result"]) for r in rows if r["result"]}
+
+def counts():
+    """{status: n} over the whole queue; lease-expired running jobs count as pending until claim() settles them."""
+    now = time.time()
+    with _connect() as conn:
+        rows = conn.execute(
+            """SELECT CASE WHEN status = 'running' AND lease_until < ? THEN 'pending' ELSE status END AS s,
+                      COUNT(*) AS n
+               FROM jobs GROUP BY s""",
+            (now,)
+        ).fetchall()
+    return {r["s"]: r["n"] for r in rows}
@@ -2,7 +2,7 @@ import subprocess
 import sys
 import time
 
-def run_script(script_name):
+def run_script(script_name, *args):
     """Runs a python script and waits for it to finish."""
     print(f"\n{'='*50}")
     print(f"🚀 Starting {script_name}...")
@@ -10,7 +10,7 @@ def run_script(script_name):
     
     try:
         # sys.executable ensures we use the same python interpreter
-        result = subprocess.run([sys.executable, script_name], check=True)
+        result = subprocess.run([sys.executable, script_name, *args], check=True)
         print(f"\n✅ {script_name} finished successfully.")
         return True
     except subprocess.CalledProcessError as e:
@@ -22,15 +22,22 @@ def run_script(script_name):
 
 def main():
     scripts = [
-        "planner.py",
-        "painter.py",
-        "publisher.py"
+        ("planner.py",),
+        ("painter.py",),
+        ("publisher.py",)
     ]
     
+    # --overlap: 浏览器启动/登录与图片生成并行，每张图片生成后立即上传
+    if "--overlap" in sys.argv:
+        scripts = [
+            ("planner.py",),
+            ("publisher.py", "--paint")
+        ]
+    
     total_start_time = time.time()
     
-    for script in scripts:
-        success = run_script(script)
+    for script, *args in scripts:
+        success = run_script(script, *args)
         if not success:
             print(f"\n⛔ Pipeline stopped due to failure in {script}.")
             sys.exit(1)
@@ -1,25 +1,83 @@
 import os
+import sys
 import json
 import time
-from tenacity import retry, stop_after_attempt, wait_fixed
+import base64
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_fixed
 from dotenv import load_dotenv
 from openai import OpenAI
 from google import genai
 import requests
+from PIL import Image
+from cropper import crop_day, smart_crop, record_crops, energy_map
+import jobqueue
+from cassette import cached_call, CASSETTE_MODE
+from scheduler import get_scheduler, candidate_providers, configured_providers, is_rate_limited
 
 load_dotenv()
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
-def generate_image_google(prompt, output_path):
+# 生成后将方图智能裁剪为目标比例（CROP_ASPECT，默认 3:4）
+SMART_CROP = os.getenv("SMART_CROP", "true").lower() == "true"
+
+# 草稿-定稿模式：每个 prompt 先用便宜档位生成 N 张草稿，本地打分选最佳一张作为参考图再出定稿（0 为关闭）
+PAINT_DRAFTS = int(os.getenv("PAINT_DRAFTS", "0"))
+PAINT_DRAFT_WORKERS = int(os.getenv("PAINT_DRAFT_WORKERS", "4"))
+# 一张草稿相对一次定稿调用的成本估计（按服务商价目表设置；成本统计标注为估算）
+DRAFT_COST_RATIO = float(os.getenv("DRAFT_COST_RATIO", "0.3"))
+# 单次生成基线取最近多少次 single-shot 运行的 paint_report
+BASELINE_RUNS = int(os.getenv("PAINT_BASELINE_RUNS", "7"))
+# 各服务商的便宜档位；不在此列的服务商（dashscope）没有便宜档位，也不支持参考图，不走草稿流程
+DRAFT_SETTINGS = {
+    "gemini": {"model": os.getenv("LLM_DRAFT_IMAGE_MODEL", "gemini-2.5-flash-image")},
+    "doubao": {"size": "1K"},
+}
+REFERENCE_HINT = "Keep the composition, framing and color palette of the reference image; refine details and quality."
+# 草稿打分：灰度标准差低于此值视为空白/纯色图，dHash 汉明距离低于此值视为与前面的图重复
+BLANK_STD = 8.0
+DUPLICATE_DISTANCE = 6
+
+# 单个服务商上的重试：限流错误不重试（交给调度器退避并换服务商），其他错误最多 3 次
+IMAGE_RETRY = dict(
+    stop=stop_after_attempt(3),
+    wait=wait_fixed(5),
+    retry=retry_if_exception(lambda e: not is_rate_limited(e)),
+    reraise=True,
+)
+
+# 实际发出的服务商调用次数（含失败与重试），按档位计数
+_provider_calls = {"draft": 0, "final": 0}
+_calls_lock = threading.Lock()
+_call_tier = threading.local()
+
+def image_providers():
+    """Image providers to route to: those with API keys, or the whole configured list in cassette
+    replay (which needs no keys and must fingerprint requests the same way the recording did)."""
+    return configured_providers("image") if CASSETTE_MODE == "replay" else candidate_providers("image")
+
+def _count_provider_call():
+    with _calls_lock:
+        _provider_calls[getattr(_call_tier, "tier", "final")] += 1
+
+def _provider_call_counts():
+    with _calls_lock:
+        return dict(_provider_calls)
+
+def generate_image_google(prompt, output_path, model=None, reference=None):
     """Generate image using Google Gemini (Imagen 3)."""
+    _count_provider_call()
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("GEMINI_API_KEY not found")
         
     client = genai.Client(api_key=api_key)
     response = client.models.generate_content(
-        model="gemini-3-pro-image-preview",
-        contents=prompt,
+        model=model or "gemini-3-pro-image-preview",
+        # A reference image (the chosen draft) is passed alongside the prompt
+        contents=prompt if reference is None else [prompt, Image.open(reference)],
     )
     
     for part in response.parts:
@@ -29,52 +87,57 @@ def generate_image_google(prompt, output_path):
             
     raise Exception("No image returned from Google API")
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
-def generate_image_openai(prompt, output_path):
+def generate_image_openai(prompt, output_path, provider=None, model=None, size=None, reference=None):
     """Generate image using OpenAI Compatible API (DALL-E 3 protocol)."""
-    provider = os.getenv("IMAGE_LLM_PROVIDER", "openai").lower()
+    provider = (provider or os.getenv("IMAGE_LLM_PROVIDER", "openai")).lower()
     
     # Specific handling for DashScope (Aliyun)
     if provider == "dashscope":
-        return generate_image_dashscope(prompt, output_path)
+        return generate_image_dashscope(prompt, output_path, model=model, size=size)
 
+    _count_provider_call()
     api_key = None
-    model = None
     base_url = None
     
     if provider == "doubao":
         api_key = os.getenv("ARK_API_KEY")
         base_url = 'https://ark.cn-beijing.volces.com/api/v3'
-        model = os.getenv("LLM_IMAGE_MODEL", "doubao-seedream-4-5-251128")
+        model = model or os.getenv("LLM_IMAGE_MODEL", "doubao-seedream-4-5-251128")
         
         if not api_key:
             raise ValueError("ARK_API_KEY not found")
             
-        client = OpenAI(api_key=api_key, base_url=base_url)
+        extra_body = {
+            "watermark": False,
+        }
+        if reference is not None:
+            # Seedream image-to-image: the chosen draft as a base64 data URL
+            with open(reference, "rb") as f:
+                extra_body["image"] = "data:image/png;base64," + base64.b64encode(f.read()).decode("ascii")
+            
+        client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
         response = client.images.generate(
             model=model,
             prompt=prompt,
-            size="2K",
+            size=size or "2K",
             response_format="url",
-            extra_body={
-                "watermark": False,
-            },
+            extra_body=extra_body,
         )
     else:
         api_key = os.getenv("GEMINI_API_KEY")
         base_url = 'https://generativelanguage.googleapis.com/v1beta/openai/'
-        model = os.getenv("LLM_IMAGE_MODEL", "gemini-3-pro-image-preview")
+        model = model or os.getenv("LLM_IMAGE_MODEL", "gemini-3-pro-image-preview")
         
         if not api_key:
             raise ValueError("LLM_API_KEY not found")
 
-        client = OpenAI(api_key=api_key, base_url=base_url) 
+        client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0) 
         
         response = client.images.generate(
             model=model,
             prompt=prompt,
             n=1,
-            size="1024x1024",
+            size=size or "1024x1024",
             quality="standard",
         )
     
@@ -85,14 +148,14 @@ def generate_image_openai(prompt, output_path):
     with open(output_path, 'wb') as f:
         f.write(img_data)
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
-def generate_image_dashscope(prompt, output_path):
+def generate_image_dashscope(prompt, output_path, model=None, size=None):
     """Generate image using DashScope native API."""
+    _count_provider_call()
     api_key = os.getenv("DASHSCOPE_API_KEY")
     if not api_key:
         raise ValueError("DASHSCOPE_API_KEY not found")
         
-    model = os.getenv("LLM_IMAGE_MODEL", "qwen-image-plus")
+    model = model or os.getenv("LLM_IMAGE_MODEL", "qwen-image-plus")
     url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
     
     headers = {
@@ -121,7 +184,7 @@ def generate_image_dashscope(prompt, output_path):
             ]
         },
         "parameters": {
-            "size": "1024*1024",
+            "size": size or "1024*1024",
             "n": 1
         }
     }
@@ -151,21 +214,83 @@ def generate_image_dashscope(prompt, output_path):
         
     raise Exception(f"Unexpected response format from DashScope: {result}")
 
-def generate_image(prompt, output_path, index):
-    print(f"Generating image {index}...")
+def render_image(prompt, output_path, tier="final", reference=None, providers=None):
+    """Generate one image on a scheduler-admitted provider. Raises if every attempt fails.
+
+    tier="draft" applies the provider's DRAFT_SETTINGS; `reference` is a draft the final
+    render should follow.
+    """
+    scheduler = get_scheduler()
+    providers = providers or image_providers()
+    _call_tier.tier = tier
+    if reference is not None:
+        prompt = f"{prompt}\n{REFERENCE_HINT}"
+    
+    # A 429 is never retried in place: it backs that provider off and routes to the next one with headroom
+    for attempt in range(len(providers)):
+        provider = scheduler.acquire("image", providers)
+        overrides = DRAFT_SETTINGS.get(provider, {}) if tier == "draft" else {}
+        try:
+            # Other errors are retried on the same provider, each retry admitted by the scheduler
+            for retry_attempt in Retrying(**IMAGE_RETRY):
+                with retry_attempt:
+                    if retry_attempt.retry_state.attempt_number > 1:
+                        scheduler.acquire("image", [provider])
+                    if provider == "gemini":
+                        print(f"Using Provider: Gemini (Imagen 3){' [draft]' if tier == 'draft' else ''}")
+                        generate_image_google(prompt, output_path, reference=reference, **overrides)
+                    else:
+                        # Default to OpenAI Compatible for all other providers
+                        print(f"Using Provider: OpenAI Compatible ({provider}){' [draft]' if tier == 'draft' else ''}")
+                        generate_image_openai(prompt, output_path, provider, reference=reference, **overrides)
+            return
+        except Exception as e:
+            if not is_rate_limited(e):
+                raise
+            scheduler.penalize("image", provider)
+            if attempt == len(providers) - 1:
+                raise
+            print(f"⚠️  {provider} rate limited, rerouting...")
+
+def partial_path(path):
+    """'1.png' -> '1.partial.png': where an image is written before being renamed into place."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.partial{ext}"
+
+def generate_image(prompt, output_path, index, tier="final", variant=0, reference=None, providers=None):
+    print(f"Generating image {index}{f' (draft {variant + 1})' if tier == 'draft' else ''}...")
+    tmp_path = partial_path(output_path)
+    
+    def call():
+        render_image(prompt, tmp_path, tier, reference, providers)
+        with open(tmp_path, "rb") as f:
+            return f.read()
     
-    provider = os.getenv("IMAGE_LLM_PROVIDER", "gemini").lower()
+    # The configured provider list (not the key-filtered one, so replay works without keys),
+    # model and tier settings are part of the fingerprint: a replay after switching
+    # IMAGE_LLM_PROVIDER(S)/LLM_IMAGE_MODEL never serves another provider's bytes
+    configured = configured_providers("image")
+    request = {
+        "prompt": prompt,
+        "providers": configured,
+        "model": os.getenv("LLM_IMAGE_MODEL"),
+        "tier": tier,
+    }
+    if tier == "draft":
+        request.update(variant=variant, settings={p: DRAFT_SETTINGS[p] for p in configured if p in DRAFT_SETTINGS})
+    elif reference is not None:
+        request["from_draft"] = True
     
     try:
-        if provider == "gemini":
-            print(f"Using Provider: Gemini (Imagen 3)")
-            generate_image_google(prompt, output_path)
-        else:
-            # Default to OpenAI Compatible for all other providers
-            print(f"Using Provider: OpenAI Compatible ({os.getenv('LLM_BASE_URL')})")
-            generate_image_openai(prompt, output_path)
+        # Record/replay through the cassette store when PROVIDER_CASSETTE is set
+        image_bytes = cached_call("image", request, call, binary=True, same=("providers", "model", "tier"))
+        # Write-then-rename: an interrupted run never leaves a truncated N.png that later runs would skip
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, output_path)
             
         print(f"✅ Saved: {output_path}")
+        return True
         
     except Exception as e:
         print(f"❌ Error generating image {index}: {e}")
@@ -173,6 +298,140 @@ def generate_image(prompt, output_path, index):
         # from PIL import Image, ImageDraw
         # img = Image.new('RGB', (1024, 1280), color=(50, 50, 50))
         # img.save(output_path)
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _dhash(img, size=8):
+    """64-bit difference hash as a flat bool array."""
+    gray = np.asarray(img.convert("L").resize((size + 1, size)), dtype=np.int16)
+    return (gray[:, 1:] > gray[:, :-1]).ravel()
+
+def score_draft(path, chosen_hashes):
+    """Local quality score of a draft (higher is better) and its dHash; -inf for unusable drafts.
+
+    Drafts that fail to decode, are blank, or nearly duplicate an image already chosen
+    for an earlier slot are rejected; the rest are ranked by mean gradient energy.
+    """
+    if not is_valid_image(path):
+        return float("-inf"), None
+    with Image.open(path) as img:
+        img.load()
+    digest = _dhash(img)
+    if np.asarray(img.convert("L"), dtype=np.float32).std() < BLANK_STD:
+        return float("-inf"), digest
+    if any(np.count_nonzero(digest != h) < DUPLICATE_DISTANCE for h in chosen_hashes):
+        return float("-inf"), digest
+    return float(energy_map(img).mean()), digest
+
+def single_shot_baseline(content_root="content", exclude_date=None, runs=BASELINE_RUNS):
+    """Provider calls and wall seconds per accepted image, pooled over the last `runs` recorded
+    single-shot paint_reports; None until one has been recorded."""
+    reports = []
+    if os.path.isdir(content_root):
+        for date in sorted(os.listdir(content_root), reverse=True):
+            meta_path = os.path.join(content_root, date, "meta.json")
+            if date == exclude_date or not os.path.exists(meta_path):
+                continue
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    report = json.load(f).get("paint_report") or {}
+            except (OSError, ValueError):
+                continue
+            if report.get("mode") == "single-shot" and report.get("accepted"):
+                reports.append((date, report))
+            if len(reports) == runs:
+                break
+    if not reports:
+        return None
+    accepted = sum(r["accepted"] for _, r in reports)
+    return {
+        "runs": [date for date, _ in reports],
+        "calls_per_image": round(sum(r["final_calls"] for _, r in reports) / accepted, 3),
+        "latency_per_image": round(sum(r["seconds"] for _, r in reports) / accepted, 2),
+    }
+
+def save_paint_report(meta_path, report):
+    with open(meta_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["paint_report"] = report
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+def paint_with_drafts(work_dir, prompts, drafts=PAINT_DRAFTS):
+    """Draft-then-finalize: render `drafts` cheap variants per prompt concurrently, keep the best
+    by local score, then render the finals from the chosen drafts. Returns the cost/latency report."""
+    providers = [p for p in image_providers() if p in DRAFT_SETTINGS]
+    todo = [i for i in range(len(prompts)) if not os.path.exists(os.path.join(work_dir, f"{i+1}.png"))]
+    calls_before = _provider_call_counts()
+    started = time.perf_counter()
+    
+    with tempfile.TemporaryDirectory(prefix="drafts-") as draft_dir, ThreadPoolExecutor(max_workers=PAINT_DRAFT_WORKERS) as pool:
+        # 1. All drafts of all prompts in parallel
+        draft_jobs = [
+            pool.submit(generate_image, prompts[i], os.path.join(draft_dir, f"{i+1}-{v+1}.png"),
+                        i + 1, "draft", v, None, providers)
+            for i in todo for v in range(drafts)
+        ]
+        for future in draft_jobs:
+            future.result()
+        
+        # 2. Pick the best draft per slot, in slot order so duplicates of earlier picks are penalised
+        chosen, chosen_hashes = {}, []
+        for i in todo:
+            scored = []
+            for v in range(drafts):
+                path = os.path.join(draft_dir, f"{i+1}-{v+1}.png")
+                score, digest = score_draft(path, chosen_hashes)
+                scored.append((score, v, path, digest))
+            score, v, path, digest = max(scored, key=lambda s: s[0])
+            if score == float("-inf"):
+                print(f"⚠️  No usable draft for image {i+1}, rendering it without a reference")
+                chosen[i] = None
+                continue
+            print(f"🎯 Image {i+1}: picked draft {v + 1}/{drafts} (score {score:.3f})")
+            chosen[i] = path
+            chosen_hashes.append(digest)
+        
+        # 3. Finals from the chosen drafts, in parallel
+        final_jobs = [
+            pool.submit(generate_image, prompts[i], os.path.join(work_dir, f"{i+1}.png"),
+                        i + 1, "final", 0, chosen[i], providers if chosen[i] else None)
+            for i in todo
+        ]
+        accepted = sum(1 for future in final_jobs if future.result())
+    
+    elapsed = time.perf_counter() - started
+    calls_after = _provider_call_counts()
+    # Every provider request actually sent, including failed and retried ones
+    draft_calls = calls_after["draft"] - calls_before["draft"]
+    final_calls = calls_after["final"] - calls_before["final"]
+    baseline = single_shot_baseline(exclude_date=os.path.basename(os.path.normpath(work_dir)))
+    report = {
+        "mode": "draft",
+        "drafts_per_prompt": drafts,
+        "draft_calls": draft_calls,
+        "final_calls": final_calls,
+        "accepted": accepted,
+        "seconds": round(elapsed, 2),
+        # Estimate in units of one final-tier call: drafts are weighted by DRAFT_COST_RATIO, not billed prices
+        "draft_cost_ratio": DRAFT_COST_RATIO,
+        "cost_per_image_estimate": round((draft_calls * DRAFT_COST_RATIO + final_calls) / accepted, 3) if accepted else None,
+        "latency_per_image": round(elapsed / accepted, 2) if accepted else None,
+        # Measured from recorded single-shot runs (PAINT_DRAFTS=0), not assumed
+        "baseline": baseline,
+    }
+    print(f"\n📊 Drafts: {draft_calls} draft + {final_calls} final provider calls, {accepted} accepted")
+    if accepted:
+        print(f"   est. cost/image {report['cost_per_image_estimate']} final-call units "
+              f"(DRAFT_COST_RATIO={DRAFT_COST_RATIO}), latency/image {report['latency_per_image']}s")
+        if baseline:
+            print(f"   single-shot baseline ({len(baseline['runs'])} runs): {baseline['calls_per_image']} calls/image, "
+                  f"{baseline['latency_per_image']}s/image")
+        else:
+            print("   no single-shot baseline recorded yet (run once with PAINT_DRAFTS=0 to record one)")
+    return report
 
 def run_painter():
     # Find the latest content folder
@@ -203,23 +462,161 @@ def run_painter():
     print(f"Output directory: {work_dir}")
     print("-" * 50)
     
-    for i, prompt in enumerate(prompts):
-        output_filename = f"{i+1}.png"
-        output_path = os.path.join(work_dir, output_filename)
-        
-        if os.path.exists(output_path):
-            print(f"Image {output_filename} already exists. Skipping.")
-            continue
-        
-        print(f"\nPrompt {i+1}: {prompt[:80]}...")
-        generate_image(prompt, output_path, i+1)
+    if PAINT_DRAFTS > 0 and any(p in DRAFT_SETTINGS for p in image_providers()):
+        save_paint_report(meta_path, paint_with_drafts(work_dir, prompts))
+    else:
+        if PAINT_DRAFTS > 0:
+            print("⚠️  No image provider with a draft tier configured, generating single-shot")
+        calls_before = _provider_call_counts()["final"]
+        started = time.perf_counter()
+        attempted = accepted = 0
+        for i, prompt in enumerate(prompts):
+            output_filename = f"{i+1}.png"
+            output_path = os.path.join(work_dir, output_filename)
+            
+            if os.path.exists(output_path):
+                print(f"Image {output_filename} already exists. Skipping.")
+                continue
+            
+            print(f"\nPrompt {i+1}: {prompt[:80]}...")
+            # Rate limiting is handled by the scheduler's per-provider budgets
+            attempted += 1
+            accepted += generate_image(prompt, output_path, i+1)
         
-        # Rate limiting
-        if i < len(prompts) - 1:
-            time.sleep(2)
+        if attempted:
+            # Recorded so draft runs can compare against a measured single-shot baseline
+            save_paint_report(meta_path, {
+                "mode": "single-shot",
+                "final_calls": _provider_call_counts()["final"] - calls_before,
+                "accepted": accepted,
+                "seconds": round(time.perf_counter() - started, 2),
+            })
+    
+    if SMART_CROP:
+        print("\nCropping images to the target aspect ratio...")
+        crop_day(work_dir)
     
     print("\n" + "=" * 50)
     print("Image generation complete!")
 
+def is_valid_image(path):
+    """The file exists, is non-empty and decodes as an image."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    try:
+        with Image.open(path) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+
+class PaintStream:
+    """Iterator over the day's image paths in prompt order, produced by a background thread.
+
+    Callers must join() it (e.g. in a finally block) so an early exit never abandons paid
+    generations or skips recording the crop windows.
+    """
+
+    def __init__(self, prompts, produce):
+        self.ready = [threading.Event() for _ in prompts]
+        self.paths = [None] * len(prompts)
+        # Non-daemon: the interpreter waits for the producer even if join() is missed
+        self.thread = threading.Thread(target=produce, args=(self,))
+        self.thread.start()
+
+    def __iter__(self):
+        for i, event in enumerate(self.ready):
+            event.wait()
+            if self.paths[i]:
+                yield self.paths[i]
+
+    def join(self):
+        if self.thread.is_alive():
+            print("⏳ Waiting for the remaining images to finish generating...")
+        self.thread.join()
+
+def paint_stream(work_dir, prompts):
+    """Generate the day's images in a background thread; returns a PaintStream over the N.png paths
+    in prompt order, each yielded as soon as it has been written, validated (and cropped)."""
+    
+    def produce(stream):
+        crops = {}
+        try:
+            for i, prompt in enumerate(prompts):
+                output_path = os.path.join(work_dir, f"{i+1}.png")
+                try:
+                    if not os.path.exists(output_path):
+                        print(f"\nPrompt {i+1}: {prompt[:80]}...")
+                        generate_image(prompt, output_path, i+1)
+                    if is_valid_image(output_path):
+                        if SMART_CROP:
+                            crop = smart_crop(output_path)
+                            if crop:
+                                crops[f"{i+1}.png"] = crop
+                        stream.paths[i] = os.path.abspath(output_path)
+                    else:
+                        print(f"❌ Image {i+1} is missing or invalid, skipping upload")
+                except Exception as e:
+                    print(f"❌ Error preparing image {i+1}: {e}")
+                finally:
+                    stream.ready[i].set()
+        finally:
+            record_crops(work_dir, crops)
+    
+    # Start generating right away, not on first iteration, so it overlaps the browser startup
+    return PaintStream(prompts, produce)
+
+def _keep_lease(job_id, worker, stop):
+    while not stop.wait(jobqueue.LEASE_SECONDS / 3):
+        if not jobqueue.heartbeat(job_id, worker):
+            print(f"⚠️  Lease on job {job_id} lost")
+            return
+
+def run_worker(poll_interval=5):
+    """Claim image jobs from the render queue until it is drained.
+
+    Any number of workers on this machine can run concurrently; a job whose worker stops
+    heartbeating is re-claimed after its lease expires.
+    """
+    worker = jobqueue.worker_name()
+    print(f"👷 Worker {worker} started (queue: {jobqueue.QUEUE_PATH})")
+    
+    while True:
+        job = jobqueue.claim(worker)
+        if job is None:
+            counts = jobqueue.counts()
+            if not counts.get("pending") and not counts.get("running"):
+                print(f"Queue drained: {counts}")
+                return
+            time.sleep(poll_interval)
+            continue
+        
+        print(f"\n[{job['work_dir']}] Prompt {job['idx']} (attempt {job['attempts']}): {job['prompt'][:80]}...")
+        stop = threading.Event()
+        keeper = threading.Thread(target=_keep_lease, args=(job["id"], worker, stop), daemon=True)
+        keeper.start()
+        try:
+            # A worker that lost this job's lease may still have finished the image meanwhile
+            ok = os.path.exists(job["output_path"]) or generate_image(job["prompt"], job["output_path"], job["idx"]) or os.path.exists(job["output_path"])
+            crop = smart_crop(job["output_path"]) if ok and SMART_CROP else None
+        except Exception as e:
+            print(f"❌ Error post-processing image {job['idx']}: {e}")
+            ok, crop = False, None
+        finally:
+            stop.set()
+            keeper.join()
+        
+        if ok:
+            day_results = jobqueue.complete(job["id"], worker, crop)
+        else:
+            day_results = jobqueue.fail(job["id"], worker, "generation failed")
+        if day_results is not None:
+            # This worker finished the day's last job: write all crop windows into meta.json at once
+            record_crops(job["work_dir"], {f"{idx}.png": result for idx, result in day_results.items()})
+            print(f"🎉 All jobs for {job['work_dir']} are finished")
+
 if __name__ == "__main__":
-    run_painter()
+    if "--worker" in sys.argv:
+        run_worker()
+    else:
+        run_painter()
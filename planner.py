@@ -1,15 +1,58 @@
 import os
 import json
 import random
+import hashlib
+import time
 import datetime
+import queue
+import threading
 from typing import List
-from pydantic import BaseModel, Field
-from openai import OpenAI
+from pydantic import BaseModel, Field, ValidationError
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_fixed
 from dotenv import load_dotenv
+from cassette import cached_call, recorded_values, CASSETTE_MODE
+from history import PromptHistory
+import jobqueue
+from scheduler import get_scheduler, candidate_providers, configured_providers, is_rate_limited
 
 # Load environment variables
 load_dotenv()
 
+IMAGE_PROMPT_COUNT = 6
+# 校验失败时，只针对缺失/不合法字段补充请求的最大轮数
+PLAN_REPAIR_ATTEMPTS = int(os.getenv("PLAN_REPAIR_ATTEMPTS", "2"))
+# 调度器预占的 Token 估算值，调用返回后按实际用量修正
+PLAN_TOKEN_ESTIMATE = 6000
+REPAIR_TOKEN_ESTIMATE = 2000
+# 连接错误/5xx 的重试次数（含首次）；限流与超时不在此重试，分别交给调度器退避和 hedge
+PLAN_HTTP_ATTEMPTS = 3
+
+# 对冲请求：主 provider 超过其 p95 延迟仍未返回时，向备用 provider（PLAN_HEDGE_PROVIDERS）并发同一请求
+PLAN_HEDGE = os.getenv("PLAN_HEDGE", "false").lower() == "true"
+# 历史样本不足时使用的对冲延迟（秒）
+PLAN_HEDGE_DELAY = float(os.getenv("PLAN_HEDGE_DELAY", "90"))
+# 单次策划请求的超时（秒）
+PLAN_REQUEST_TIMEOUT = float(os.getenv("PLAN_REQUEST_TIMEOUT", "300"))
+PLAN_LATENCY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".plan_latency.json")
+PLAN_LATENCY_SAMPLES = 50
+_latency_lock = threading.Lock()
+
+# 历史去重：与近 HISTORY_WINDOW_DAYS 天 prompt 的余弦相似度超过阈值则重新生成；
+# 风格/IP 按最近使用日期轮换（优先选最久未用的），近 HISTORY_AVOID_DAYS 天的标题提示模型避开
+PROMPT_SIMILARITY_THRESHOLD = float(os.getenv("PROMPT_SIMILARITY_THRESHOLD", "0.6"))
+HISTORY_WINDOW_DAYS = int(os.getenv("HISTORY_WINDOW_DAYS", "90"))
+HISTORY_AVOID_DAYS = int(os.getenv("HISTORY_AVOID_DAYS", "7"))
+
+# 为每个图片 prompt 推送渲染任务到队列，由 painter worker 并行领取
+RENDER_QUEUE = os.getenv("RENDER_QUEUE", "false").lower() == "true"
+
+SYSTEM_PROMPT = "You are a helpful assistant. Output valid JSON only."
+# 前缀缓存：implicit（默认，仅保证静态前缀在前）或 explicit（Gemini cachedContents / DashScope cache_control）
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "implicit").lower()
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+PROMPT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".prompt_cache.json")
+
 # 独立的大型IP库：包含50+经典/高人气动漫系列
 ANIME_IPS = [
     # 热血少年
@@ -85,7 +128,11 @@ class DailyContent(BaseModel):
     title: str = Field(description="Catchy Xiaohongshu title (include emojis)")
     content: str = Field(description="Engaging body text for the post, emotional and atmospheric")
     tags: List[str] = Field(description="List of hashtags (e.g., #Ghibli #Anime #Wallpaper)")
-    image_prompts: List[str] = Field(description="List of 6 distinct but thematically consistent image prompts for the AI")
+    image_prompts: List[str] = Field(
+        description="List of 6 distinct but thematically consistent image prompts for the AI",
+        min_length=IMAGE_PROMPT_COUNT,
+        max_length=IMAGE_PROMPT_COUNT,
+    )
 
 STYLES = {
     "makoto_shinkai": {
@@ -178,19 +225,63 @@ STYLES = {
     }
 }
 
-def get_common_prompt(today: str) -> str:
-    # Randomly select a style
-    style_key = random.choice(list(STYLES.keys()))
-    style_config = STYLES[style_key]
-
-    # Randomly select an IP from the independent IP pool
-    selected_ip = random.choice(ANIME_IPS)
+def _last_used(history, today):
+    """Last date each style key and IP name was used before `today`, inferred from past meta.json."""
+    styles, ips = {}, {}
+    style_keys = {config["name"]: key for key, config in STYLES.items()}
+    for date, meta in history.metas:
+        if today and date >= today:
+            continue
+        if meta.get("style_name") in style_keys:
+            key = style_keys[meta["style_name"]]
+            styles[key] = max(styles.get(key, ""), date)
+        if meta.get("ip"):
+            names = [meta["ip"]]
+        else:
+            # 旧的 meta.json 没有记录 IP，按标题/正文/标签中出现的作品名推断
+            text = " ".join([meta.get("title", ""), meta.get("theme", ""), meta.get("content", "")] + meta.get("tags", []))
+            names = [ip["name"] for ip in ANIME_IPS if ip["name"] in text]
+        for name in names:
+            ips[name] = max(ips.get(name, ""), date)
+    return styles, ips
+
+def _least_recent(items, last_used):
+    """Random choice among the items whose last use is the oldest (never used counts as oldest)."""
+    oldest = min(last_used.get(item, "") for item in items)
+    return random.choice([item for item in items if last_used.get(item, "") == oldest])
+
+def pick_style_and_ip(history=None, today=None):
+    """Pick the least recently used style and IP (random among ties); uniform random without history."""
+    if history is None:
+        return random.choice(list(STYLES.keys())), random.choice(ANIME_IPS)
+    style_last, ip_last = _last_used(history, today)
+    style_key = _least_recent(list(STYLES.keys()), style_last)
+    ip_name = _least_recent([ip["name"] for ip in ANIME_IPS], ip_last)
+    return style_key, next(ip for ip in ANIME_IPS if ip["name"] == ip_name)
+
+def build_static_prefix() -> str:
+    """The part of the planner prompt that is identical every day (role, all styles, rules, JSON shape).
+
+    It must come first and must not contain anything date- or pick-dependent, so that
+    providers' prefix caches can match it across runs.
+    """
+    style_sections = "\n".join(
+        f"""
+    ### {config['name']}
+       定位：{config['description']}
+       必须包含的关键词/标签：{config['keywords']}
+       格式示例：
+       {config['prompt_example']}
+       关键要求：
+       {config['visual_requirements']}"""
+        for config in STYLES.values()
+    )
 
     # Construct a clear JSON example structure
     json_structure_example = {
-        "date": today,
+        "date": "YYYY-MM-DD",
         "theme": "填入主题",
-        "style_name": style_config['name'],
+        "style_name": "今日风格名称",
         "title": "填入标题",
         "content": "填入正文",
         "tags": ["#标签1", "#标签2"],
@@ -205,46 +296,64 @@ def get_common_prompt(today: str) -> str:
     }
 
     return f"""
-    你是小红书**{style_config['name']}**风格壁纸账号的创意总监。我们的定位是{style_config['description']}。
+    你是小红书动漫壁纸账号的创意总监。账号每天从下面的风格库中选用一种风格，今日风格与指定IP见文末「今日任务」。
 
-    任务：为今天（{today}）策划内容。
+    ## 风格库
+    {style_sections}
 
-    要求：
-    1. 选择一个符合**{style_config['name']}**氛围的主题。
+    ## 要求
+    1. 选择一个符合今日风格氛围的主题。
 
     2. 标题、正文、标签必须用中文，要贴合小红书用户喜好，情感共鸣强，适当使用emoji。
-       必须包含的关键词/标签：{style_config['keywords']}
+       必须包含今日风格的关键词/标签。
 
-    3. 生成6个详细的图片prompt，优化用于{os.getenv('IMAGE_LLM_PROVIDER', 'Nano Banana')}：
-
-       格式示例：
-       {style_config['prompt_example']}
-
-       关键要求：
-       {style_config['visual_requirements']}
+    3. 生成6个详细的图片prompt，遵循今日风格的格式示例与关键要求。
 
     4. 动漫IP策略（重要）：
-       * **本次指定IP**：{selected_ip['name']}
-       * **可用角色**：{selected_ip['characters']}
-       * **风格适配**：请用「{style_config['name']}」的视觉风格重新演绎上述角色
+       * 只使用今日任务中**指定的IP**及其**可用角色**
+       * **风格适配**：请用今日风格的视觉风格重新演绎上述角色
        * **角色多元**：6张图必须展示该IP下的不同角色，严禁6张图都是同一角色
        * **性别多样**：务必包含男性角色和男女互动场景
        * 角色必须清晰描述外貌特征（发色、服装、标志性物品）以便AI准确生成
 
-    5. 6张图保持**{style_config['name']}**风格统一，场景各异。
+    5. 6张图保持今日风格统一，场景各异。
 
     6. 固定后缀：每个prompt必须以" --ar 3:4"结尾。
 
     输出JSON格式。
     注意：必须直接返回填写好的JSON数据对象，**绝对不要**返回Schema定义，不要包含 "type", "description" 等Schema字段。
 
-    目标JSON结构示例（请填充具体内容）：
+    目标JSON结构示例（请填充具体内容，date 和 style_name 按今日任务填写）：
     {json.dumps(json_structure_example, ensure_ascii=False, indent=2)}
     """
 
-def get_client_config():
+PLAN_PREFIX = build_static_prefix()
+
+def get_common_prompt(today: str, style_key=None, selected_ip=None, recent_titles=None) -> str:
+    """The small per-day suffix that follows PLAN_PREFIX."""
+    # Randomly select a style
+    style_key = style_key or random.choice(list(STYLES.keys()))
+    style_config = STYLES[style_key]
+
+    # Randomly select an IP from the independent IP pool
+    selected_ip = selected_ip or random.choice(ANIME_IPS)
+    
+    recent_note = ""
+    if recent_titles:
+        recent_note = "\n    * 近期已发布（请避免重复这些主题和场景）：" + "；".join(recent_titles)
+
+    return f"""
+    ## 今日任务
+    * 日期：{today}
+    * 今日风格：**{style_config['name']}**
+    * 图片prompt优化用于：{os.getenv('IMAGE_LLM_PROVIDER', 'Nano Banana')}
+    * **本次指定IP**：{selected_ip['name']}
+    * **可用角色**：{selected_ip['characters']}{recent_note}
+    """
+
+def get_client_config(provider=None):
     """Determine API configuration based on environment variables."""
-    provider = os.getenv("TEXT_LLM_PROVIDER", "gemini").lower()
+    provider = (provider or os.getenv("TEXT_LLM_PROVIDER", "gemini")).lower()
     
     if provider == "gemini":
         # Google Gemini via OpenAI Compatible Endpoint
@@ -252,6 +361,7 @@ def get_client_config():
             "api_key": os.getenv("GEMINI_API_KEY"),
             "base_url": "https://generativelanguage.googleapis.com/v1beta/openai/",
             "model": "gemini-2.5-pro", # Use a cheaper/faster model if desired, but pro is fine
+            "provider": "gemini",
             "provider_name": "Gemini (OpenAI Interface)"
         }
     elif provider == "doubao":
@@ -259,6 +369,7 @@ def get_client_config():
             "api_key": os.getenv("ARK_API_KEY"),
             "base_url": 'https://ark.cn-beijing.volces.com/api/v3',
             "model": os.getenv("LLM_MODEL_NAME", "doubao-1-5-pro-32k-250115"),
+            "provider": "doubao",
             "provider_name": "Ark (OpenAI Interface)"
         }
     elif provider == "dashscope":
@@ -266,6 +377,7 @@ def get_client_config():
             "api_key": os.getenv("DASHSCOPE_API_KEY"),
             "base_url": 'https://dashscope.aliyuncs.com/compatible-mode/v1',
             "model": os.getenv("LLM_MODEL_NAME", "qwen3-max"),
+            "provider": "dashscope",
             "provider_name": "Dashscope (OpenAI Interface)"
         }
     else:
@@ -274,71 +386,531 @@ def get_client_config():
             "api_key": os.getenv("GEMINI_API_KEY"),
             "base_url": "https://generativelanguage.googleapis.com/v1beta/openai/",
             "model": "gemini-2.5-pro",
+            "provider": "gemini",
             "provider_name": "Gemini (OpenAI Interface)"
         }   
 
+def _clean_plan_data(content):
+    """Parse a JSON response and unwrap the schema-style shapes some providers return."""
+    data = json.loads(content)
+
+    # Fix for Doubao/Qwen: sometimes they return the schema wrapped in "properties"
+    if "properties" in data:
+        data = data["properties"]
+
+    # Fix for Doubao/Qwen: sometimes values are objects with "value" and "description"
+    cleaned_data = {}
+    for k, v in data.items():
+        if isinstance(v, dict) and "value" in v:
+            cleaned_data[k] = v["value"]
+        elif isinstance(v, dict) and "type" in v and "description" in v:
+             # This looks like a schema definition, not a value. 
+             # We shouldn't use it.
+             pass
+        else:
+            cleaned_data[k] = v
+
+    return cleaned_data
+
+def _new_usage_stats():
+    return {
+        kind: {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "seconds": 0.0}
+        for kind in ("generate", "repair", "hedge")
+    }
+
+def _load_prompt_cache_handles():
+    if not os.path.exists(PROMPT_CACHE_PATH):
+        return {}
+    try:
+        with open(PROMPT_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_prompt_cache_handles(handles):
+    with open(PROMPT_CACHE_PATH, "w", encoding="utf-8") as f:
+        json.dump(handles, f, indent=2)
+
+def _gemini_cached_content(config, prefix):
+    """Return a Gemini cachedContents handle for SYSTEM_PROMPT + prefix, or None to use implicit caching.
+
+    A cache is billed for creation and storage, so one is only created once the same prefix
+    was already sent within PROMPT_CACHE_TTL (reruns, several plans a day); a lone daily run
+    never reuses it.
+    """
+    key = hashlib.sha256(f"{config['model']}|{SYSTEM_PROMPT}|{prefix}".encode("utf-8")).hexdigest()[:16]
+    handles = _load_prompt_cache_handles()
+    entry = handles.get("gemini")
+    if entry and entry["key"] == key and entry.get("name") and entry["expires"] > time.time() + 60:
+        return entry["name"]
+
+    last_sent = entry.get("last_sent", 0) if entry and entry["key"] == key else 0
+    if time.time() - last_sent > PROMPT_CACHE_TTL:
+        handles["gemini"] = {"key": key, "last_sent": time.time()}
+        _save_prompt_cache_handles(handles)
+        print("🧠 Prefix not sent within the cache TTL, using implicit caching for this request")
+        return None
+
+    try:
+        from google import genai
+        from google.genai import types
+        cache = genai.Client(api_key=config["api_key"]).caches.create(
+            model=f"models/{config['model']}",
+            config=types.CreateCachedContentConfig(
+                system_instruction=SYSTEM_PROMPT,
+                contents=[types.Content(role="user", parts=[types.Part(text=prefix)])],
+                ttl=f"{PROMPT_CACHE_TTL}s",
+            ),
+        )
+    except Exception as e:
+        # e.g. prefix below the model's minimum cacheable size; implicit caching still applies
+        print(f"⚠️  Could not create Gemini cached content, using implicit caching: {e}")
+        return None
+
+    handles["gemini"] = {"key": key, "name": cache.name, "expires": time.time() + PROMPT_CACHE_TTL, "last_sent": time.time()}
+    _save_prompt_cache_handles(handles)
+    print(f"🧠 Created Gemini cached content {cache.name}")
+    return cache.name
+
+def _build_messages(config, prompt, prefix):
+    """Lay out messages static-first; returns (messages, extra create() kwargs)."""
+    system = {"role": "system", "content": SYSTEM_PROMPT}
+    if not prefix:
+        return [system, {"role": "user", "content": prompt}], {}
+
+    if PROMPT_CACHE == "explicit" and CASSETTE_MODE != "replay":
+        if config["provider"] == "dashscope":
+            # DashScope explicit cache: mark the static block with cache_control
+            return [system, {"role": "user", "content": [
+                {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt},
+            ]}], {}
+        if config["provider"] == "gemini":
+            handle = _gemini_cached_content(config, prefix)
+            if handle:
+                # System prompt and prefix already live in the cached content
+                return [{"role": "user", "content": prompt}], {
+                    "extra_body": {"extra_body": {"google": {"cached_content": handle}}}
+                }
+
+    # Implicit prefix caching (Gemini 2.5, Ark, DashScope) only needs the static part first
+    return [system, {"role": "user", "content": prefix + prompt}], {}
+
+def _cached_tokens(usage):
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+def _is_transient(exc):
+    """Connection drops and 5xx are worth an immediate retry; 429s and timeouts are not."""
+    return isinstance(exc, (APIConnectionError, InternalServerError)) and not isinstance(exc, APITimeoutError)
+
+def _request_json(client, config, prompt, stats, kind, prefix=None, on_latency=None):
+    """Send one JSON-mode chat request and account its tokens/latency under stats[kind].
+
+    Plan (non-repair) latencies go to the hedge p95 samples, or to `on_latency` when given.
+    """
+    scheduler = get_scheduler()
+    estimate = REPAIR_TOKEN_ESTIMATE if kind == "repair" else PLAN_TOKEN_ESTIMATE
+    messages, extra = _build_messages(config, prompt, prefix)
+    timing = {}
+
+    def send():
+        # Every real request, retries included, is admitted by the scheduler
+        scheduler.acquire("text", [config["provider"]], tokens=estimate)
+        # Time only the HTTP call, not the scheduler wait, so the hedge p95 reflects the provider
+        http_started = time.perf_counter()
+        try:
+            completion = client.chat.completions.create(
+                model=config["model"],
+                messages=messages,
+                response_format={"type": "json_object"},
+                **extra
+            )
+            timing["http"] = time.perf_counter() - http_started
+            return completion
+        except Exception as e:
+            if is_rate_limited(e):
+                scheduler.penalize("text", config["provider"])
+            raise
+
+    def call():
+        completion = Retrying(
+            stop=stop_after_attempt(PLAN_HTTP_ATTEMPTS),
+            wait=wait_fixed(2),
+            retry=retry_if_exception(_is_transient),
+            reraise=True,
+        )(send)
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            scheduler.record_tokens("text", config["provider"], usage.total_tokens or 0, estimated=estimate)
+        return {
+            "content": completion.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens or 0,
+                "completion_tokens": usage.completion_tokens or 0,
+                "cached_tokens": _cached_tokens(usage),
+            } if usage is not None else None,
+        }
+
+    started = time.perf_counter()
+    # Record/replay through the cassette store when PROVIDER_CASSETTE is set
+    response = cached_call("text", {"model": config["model"], "messages": messages}, call, same=("model",))
+    elapsed = time.perf_counter() - started
+    if kind != "repair" and "http" in timing:
+        if on_latency is not None:
+            on_latency(timing["http"])
+        else:
+            _record_latency(config["provider"], timing["http"])
+    entry = stats[kind]
+    entry["calls"] += 1
+    entry["seconds"] += elapsed
+    usage = response["usage"]
+    if usage:
+        cached = usage.get("cached_tokens", 0)
+        entry["prompt_tokens"] += usage["prompt_tokens"]
+        entry["completion_tokens"] += usage["completion_tokens"]
+        entry["cached_tokens"] += cached
+        print(f"🧠 [{config['provider']}:{kind}] input {usage['prompt_tokens']} tokens ({cached} cached / {usage['prompt_tokens'] - cached} uncached)")
+    return response["content"]
+
+def _invalid_fields(data):
+    """Return {field: reason} for every DailyContent field that is missing or invalid."""
+    try:
+        DailyContent(**data)
+        return {}
+    except ValidationError as e:
+        fields = {}
+        for err in e.errors():
+            if err["loc"]:
+                fields.setdefault(str(err["loc"][0]), err["msg"])
+        return fields
+
+def _build_repair_prompt(data, fields, today, avoid=None):
+    """Ask only for the fields that failed validation, keeping the rest of the plan as context."""
+    context = {k: v for k, v in data.items() if k not in fields}
+    asks = []
+    example = {}
+
+    for field in fields:
+        missing = IMAGE_PROMPT_COUNT - len(data["image_prompts"]) if isinstance(data.get("image_prompts"), list) else 0
+        if field == "image_prompts" and missing > 0:
+            asks.append(
+                f"- image_prompts：已有{len(data['image_prompts'])}个，请再补充{missing}个新的图片prompt，"
+                f"与已有prompt风格、角色设定保持一致，但场景不同，每个以\" --ar 3:4\"结尾。只返回新增的prompt。"
+            )
+            if avoid:
+                asks.append("  新prompt的场景不要与以下近期已发布的prompt雷同：\n" + "\n".join(f"    * {p}" for p in avoid))
+            example["image_prompts"] = [f"new image prompt {i + 1} --ar 3:4" for i in range(missing)]
+        elif field == "image_prompts":
+            asks.append(f"- image_prompts：生成{IMAGE_PROMPT_COUNT}个图片prompt，每个以\" --ar 3:4\"结尾。")
+            example["image_prompts"] = [f"image prompt {i + 1} --ar 3:4" for i in range(IMAGE_PROMPT_COUNT)]
+        elif field == "tags":
+            asks.append("- tags：中文话题标签列表，每个以#开头。")
+            example["tags"] = ["#标签1", "#标签2"]
+        else:
+            description = DailyContent.model_fields[field].description
+            asks.append(f"- {field}：{description}")
+            example[field] = "填入内容"
+
+    return f"""
+    下面是今天（{today}）的小红书内容策划，其中部分字段缺失或不合法。
+    已有内容（保持不变，仅作参考）：
+    {json.dumps(context, ensure_ascii=False, indent=2)}
+
+    请只补全以下字段：
+    {chr(10).join(asks)}
+
+    输出JSON格式，只包含上述字段：
+    {json.dumps(example, ensure_ascii=False, indent=2)}
+    """
+
+def _normalize_prompts(data):
+    """Drop non-string/empty image prompts and trim to IMAGE_PROMPT_COUNT; both are fixable locally."""
+    prompts = data.get("image_prompts")
+    if isinstance(prompts, list):
+        prompts = [p for p in prompts if isinstance(p, str) and p.strip()]
+        data["image_prompts"] = prompts[:IMAGE_PROMPT_COUNT]
+    return data
+
+def _merge_repair(data, fields, patch):
+    merged = dict(data)
+    for field in fields:
+        if field not in patch:
+            continue
+        if field == "image_prompts" and isinstance(data.get("image_prompts"), list) and isinstance(patch[field], list):
+            merged[field] = data["image_prompts"] + patch[field]
+        else:
+            merged[field] = patch[field]
+    return merged
+
+def repair_daily_plan(client, config, data, today, stats, avoid=None, plan_attempt=None):
+    """Re-request only the invalid fields of a plan instead of regenerating the whole thing."""
+    data = dict(data)
+    data.setdefault("date", today)
+
+    for attempt in range(PLAN_REPAIR_ATTEMPTS + 1):
+        # Repair replies often carry more prompts than asked for, so normalise after every merge
+        fields = _invalid_fields(_normalize_prompts(data))
+        if not fields:
+            return DailyContent(**data).model_dump()
+        if attempt == PLAN_REPAIR_ATTEMPTS:
+            break
+
+        if plan_attempt is not None:
+            plan_attempt.check()
+        print(f"🔧 Repairing fields {sorted(fields)} (attempt {attempt + 1}/{PLAN_REPAIR_ATTEMPTS})...")
+        try:
+            patch = _clean_plan_data(_request_json(client, config, _build_repair_prompt(data, fields, today, avoid), stats, "repair"))
+        except Exception as e:
+            print(f"Repair request failed: {e}")
+            continue
+        data = _merge_repair(data, fields, patch)
+
+    print(f"Validation error: fields {sorted(fields)} still invalid after repair.")
+    return None
+
+def _print_usage(stats):
+    for kind, entry in stats.items():
+        if entry["calls"]:
+            print(
+                f"📊 {kind}: {entry['calls']} call(s), "
+                f"{entry['prompt_tokens']} prompt ({entry['cached_tokens']} cached) + {entry['completion_tokens']} completion tokens, "
+                f"{entry['seconds']:.1f}s"
+            )
+
+def _load_latencies():
+    if not os.path.exists(PLAN_LATENCY_PATH):
+        return {}
+    try:
+        with open(PLAN_LATENCY_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _record_latency(provider, seconds):
+    with _latency_lock:
+        latencies = _load_latencies()
+        samples = latencies.setdefault(provider, [])
+        samples.append(round(seconds, 2))
+        latencies[provider] = samples[-PLAN_LATENCY_SAMPLES:]
+        tmp_path = PLAN_LATENCY_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(latencies, f)
+        os.replace(tmp_path, PLAN_LATENCY_PATH)
+
+def hedge_delay(provider):
+    """p95 of the provider's recorded plan latencies, or PLAN_HEDGE_DELAY until enough samples exist."""
+    samples = sorted(_load_latencies().get(provider, []))
+    if len(samples) < 5:
+        return PLAN_HEDGE_DELAY
+    return samples[int(0.95 * (len(samples) - 1))]
+
+def _hedge_configs(primary):
+    names = [p.strip().lower() for p in os.getenv("PLAN_HEDGE_PROVIDERS", "doubao,dashscope").split(",") if p.strip()]
+    configs = [get_client_config(p) for p in names if p != primary]
+    return [c for c in configs if c["api_key"]]
+
+class PlanCancelled(Exception):
+    """Raised inside a hedged attempt once another provider's plan has won."""
+
+class PlanAttempt:
+    """Shared state between generate_hedged and one in-flight _plan_attempt."""
+
+    def __init__(self, config):
+        self.config = config
+        self.started = time.perf_counter()
+        self.answered = False
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def answer(self, seconds):
+        """Record the first response's latency, unless the attempt was already cancelled
+        (and given a censored sample)."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.answered = True
+            _record_latency(self.config["provider"], seconds)
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            if not self.answered and CASSETTE_MODE != "replay":
+                # Censored sample: the cancelled request took at least this long, so the p95
+                # does not drift down just because slow requests keep getting hedged
+                provider = self.config["provider"]
+                _record_latency(provider, max(time.perf_counter() - self.started, hedge_delay(provider)))
+
+    def check(self):
+        """Raise PlanCancelled if the attempt lost; called before every follow-up request."""
+        if self._cancelled.is_set():
+            raise PlanCancelled(self.config["provider"])
+
+def _plan_attempt(config, prompt, today, stats, kind, clients, history=None, plan_attempt=None):
+    """One full plan request (plus field-level repair) against a single provider."""
+    client = OpenAI(
+        api_key=config["api_key"] or "replay",
+        base_url=config["base_url"],
+        timeout=PLAN_REQUEST_TIMEOUT,
+        # The SDK would retry 429s outside the scheduler; retries happen in _request_json instead
+        max_retries=0
+    )
+    clients.append(client)
+    
+    content = _request_json(client, config, prompt, stats, kind, prefix=PLAN_PREFIX,
+                            on_latency=plan_attempt.answer if plan_attempt is not None else None)
+    if plan_attempt is not None:
+        plan_attempt.check()
+    data = _clean_plan_data(content)
+        
+    # Validate against the Pydantic model
+    try:
+        # removing any extra keys that might cause issues if strict, 
+        # though default pydantic ignores extras unless configured otherwise.
+        # We recreate the object to ensure field order and types.
+        validated = DailyContent(**data)
+        plan = validated.model_dump()
+    except ValidationError as e:
+        print(f"Validation error: {e}. Attempting field-level repair.")
+        plan = repair_daily_plan(client, config, data, today, stats, plan_attempt=plan_attempt)
+    
+    if plan and history is not None:
+        plan = reject_repeated_prompts(client, config, plan, today, stats, history, plan_attempt)
+    return plan
+
+def reject_repeated_prompts(client, config, plan, today, stats, history, plan_attempt=None):
+    """Re-ask for image prompts that are too close to ones posted within HISTORY_WINDOW_DAYS."""
+    # One extra pass so the plan returned by the last re-ask is checked too
+    for attempt in range(PLAN_REPAIR_ATTEMPTS + 1):
+        repeats = history.find_repeats(plan["image_prompts"], PROMPT_SIMILARITY_THRESHOLD, days=HISTORY_WINDOW_DAYS, today=today)
+        print(f"🔍 History lookup: {history.last_lookup_ms:.2f}ms for {len(plan['image_prompts'])} prompts")
+        if not repeats:
+            break
+        for i, (score, match) in sorted(repeats.items()):
+            print(f"🔁 Prompt {i + 1} is {score:.2f} similar to {match['date']}: {match['text'][:60]}...")
+        if attempt == PLAN_REPAIR_ATTEMPTS:
+            print(f"⚠️  {len(repeats)} prompt(s) still repeat history after {PLAN_REPAIR_ATTEMPTS} re-asks, keeping them")
+            break
+        kept = [p for i, p in enumerate(plan["image_prompts"]) if i not in repeats]
+        avoid = [match["text"] for _, match in repeats.values()]
+        repaired = repair_daily_plan(client, config, dict(plan, image_prompts=kept), today, stats, avoid=avoid, plan_attempt=plan_attempt)
+        if repaired is None:
+            break
+        plan = repaired
+    return plan
+
+def generate_hedged(primary, secondaries, prompt, today, stats, history=None):
+    """Send the plan to `primary`; if it has not answered within its p95 latency, also try the next
+    secondary. The first plan that validates wins and the other attempts are abandoned.
+
+    Attempts run on daemon threads: a blocking HTTP call cannot be aborted from another
+    thread, so losers are left to finish in the background (their follow-up requests are
+    cancelled) and never keep the interpreter alive after the planner is done.
+    """
+    delay = hedge_delay(primary["provider"])
+    clients = []
+    waiting = list(secondaries)
+    results = queue.Queue()
+    in_flight = set()
+
+    def run(attempt, kind):
+        try:
+            results.put((attempt, _plan_attempt(attempt.config, prompt, today, stats, kind, clients, history, attempt), None))
+        except Exception as e:
+            results.put((attempt, None, e))
+
+    def submit(config, kind):
+        attempt = PlanAttempt(config)
+        in_flight.add(attempt)
+        threading.Thread(target=run, args=(attempt, kind), daemon=True).start()
+
+    def hedge(reason):
+        config = waiting.pop(0)
+        print(f"⏱️  {reason}, hedging to {config['provider_name']} | Model: {config['model']}")
+        submit(config, "hedge")
+
+    submit(primary, "generate")
+
+    try:
+        while in_flight:
+            try:
+                attempt, result, error = results.get(timeout=delay if waiting else None)
+            except queue.Empty:
+                hedge(f"No answer after {delay:.0f}s")
+                continue
+
+            in_flight.discard(attempt)
+            config = attempt.config
+            if error is not None:
+                print(f"Error from {config['provider_name']}: {error}")
+            elif result:
+                print(f"✅ Plan accepted from {config['provider_name']}")
+                return result
+
+            if not in_flight and waiting:
+                hedge("All in-flight requests failed")
+        return None
+    finally:
+        for attempt in in_flight:
+            # Losing attempts stop before their next repair/history request
+            attempt.cancel()
+        # Release pooled connections; requests already on the wire finish on their daemon threads
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
 def generate_daily_plan():
     """Generates the daily content plan."""
-    config = get_client_config()
+    # Route to the configured text provider with the most quota headroom
+    if CASSETTE_MODE == "replay":
+        # No keys needed: route to the configured provider the cassette was recorded against,
+        # not by key availability or live quota state
+        providers = configured_providers("text")
+        recorded = recorded_values("text", "model")
+        provider = next((p for p in providers if get_client_config(p)["model"] in recorded), providers[0])
+    else:
+        provider = get_scheduler().choose("text", candidate_providers("text"), tokens=PLAN_TOKEN_ESTIMATE)
+    config = get_client_config(provider)
     
-    if not config["api_key"]:
+    if not config["api_key"] and CASSETTE_MODE != "replay":
         print(f"Error: API Key not found for provider {config['provider_name']}")
         return None
         
     print(f"Using Provider: {config['provider_name']} | Model: {config['model']}")
     
     today = datetime.date.today().strftime("%Y-%m-%d")
+    stats = _new_usage_stats()
 
     try:
-        client = OpenAI(
-            api_key=config["api_key"],
-            base_url=config["base_url"]
-        )
+        # Steer away from recently used styles/IPs/scenes
+        history = PromptHistory.load(exclude_date=today)
+        style_key, selected_ip = pick_style_and_ip(history, today)
+        recent_titles = [meta["title"] for _, meta in history.recent_metas(HISTORY_AVOID_DAYS, today) if meta.get("title")]
+        prompt = get_common_prompt(today, style_key, selected_ip, recent_titles)
         
-        completion = client.chat.completions.create(
-            model=config["model"],
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant. Output valid JSON only."},
-                {"role": "user", "content": get_common_prompt(today)}
-            ],
-            response_format={"type": "json_object"}
-        )
+        secondaries = _hedge_configs(config["provider"]) if PLAN_HEDGE else []
+        if secondaries:
+            plan = generate_hedged(config, secondaries, prompt, today, stats, history)
+        else:
+            plan = _plan_attempt(config, prompt, today, stats, "generate", [], history)
         
-        content = completion.choices[0].message.content
-        data = json.loads(content)
-        
-        # Fix for Doubao/Qwen: sometimes they return the schema wrapped in "properties"
-        if "properties" in data:
-            data = data["properties"]
-
-        # Fix for Doubao/Qwen: sometimes values are objects with "value" and "description"
-        cleaned_data = {}
-        for k, v in data.items():
-            if isinstance(v, dict) and "value" in v:
-                cleaned_data[k] = v["value"]
-            elif isinstance(v, dict) and "type" in v and "description" in v:
-                 # This looks like a schema definition, not a value. 
-                 # We shouldn't use it.
-                 pass
-            else:
-                cleaned_data[k] = v
-        
-        data = cleaned_data
-            
-        # Validate against the Pydantic model
-        try:
-            # removing any extra keys that might cause issues if strict, 
-            # though default pydantic ignores extras unless configured otherwise.
-            # We recreate the object to ensure field order and types.
-            validated = DailyContent(**data)
-            return validated.model_dump()
-        except Exception as e:
-            print(f"Validation error: {e}. Data was not valid.")
-            return None
+        if plan:
+            plan["ip"] = selected_ip["name"]
+        return plan
         
     except Exception as e:
         print(f"Error generating content: {e}")
         return None
+    finally:
+        _print_usage(stats)
 
 if __name__ == "__main__":
     plan = generate_daily_plan()
@@ -356,5 +928,10 @@ if __name__ == "__main__":
             
         print(f"✅ Plan generated for {plan['date']}")
         print(f"📝 Title: {plan['title']}")
+        
+        # Push one render job per prompt for `python painter.py --worker` processes
+        if RENDER_QUEUE:
+            added = jobqueue.enqueue_prompts(date_dir, plan['image_prompts'])
+            print(f"📬 Queued {added} render jobs")
     else:
         print("❌ Failed to generate plan.")
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import time
 from playwright.sync_api import sync_playwright
@@ -14,8 +15,461 @@ load_dotenv()
 # 浏览器数据存储路径
 USER_DATA_DIR = os.path.join(os.path.dirname(__file__), ".browser_data")
 
-def publish_to_xhs():
-    """使用 Playwright 浏览器自动化发布到小红书"""
+# 已验证可用的选择器缓存，按页面构建版本区分
+SELECTOR_CACHE_PATH = os.path.join(os.path.dirname(__file__), ".selector_cache.json")
+SELECTOR_CACHE_MAX_BUILDS = 5
+
+# 各页面元素的候选选择器（按优先级排列）
+# 仅支持 CSS 选择器，以及末尾带 :has-text("...") 的 CSS 选择器，以便在页面内一次性探测
+SELECTOR_CANDIDATES = {
+    "image_tab": [
+        '[class*="tab"]:has-text("上传图文")',
+        '[class*="tab"]:has-text("图文")',
+    ],
+    # 图片上传input（排除视频上传的input）
+    "image_input": [
+        'input[type="file"][accept*="image"]',
+        'input[type="file"][accept*=".jpg"]',
+        'input[type="file"][accept*=".png"]',
+        'input[type="file"][accept*=".jpeg"]',
+        'input[type="file"][multiple]:not([accept*=".mp4"]):not([accept*=".mov"])',
+        'input[type="file"]:not([accept*=".mp4"]):not([accept*=".mov"])',
+    ],
+    "title": [
+        'input[placeholder*="标题"]',
+        'input[class*="title"]',
+        '#title',
+        '[class*="title"] input',
+        '[data-testid="title"]',
+    ],
+    "desc": [
+        '[placeholder*="正文"]',
+        '[placeholder*="描述"]',
+        '[class*="content"] textarea',
+        '[class*="desc"] textarea',
+        '#post-textarea',
+        '[contenteditable="true"]',
+    ],
+    "submit": [
+        'button.submit',
+        'button:has-text("发布")',
+        '.publish-btn',
+    ],
+}
+
+# 页面构建版本：入口脚本/样式的 URL 带内容哈希，版本更新时随之变化
+BUILD_KEY_JS = """
+() => {
+    const assets = Array.from(document.querySelectorAll('script[src], link[rel="stylesheet"][href]'))
+        .map(el => el.getAttribute('src') || el.getAttribute('href'))
+        .filter(url => url && !url.startsWith('data:'))
+        .map(url => url.split('?')[0])
+        .sort();
+    let hash = 0;
+    for (const ch of assets.join('|')) {
+        hash = (hash * 31 + ch.charCodeAt(0)) | 0;
+    }
+    return location.pathname + '#' + (hash >>> 0).toString(16);
+}
+"""
+
+# 一次 evaluate 探测所有候选选择器，返回每个角色命中的选择器列表
+PROBE_SELECTORS_JS = """
+(candidates) => {
+    const result = {};
+    for (const [role, selectors] of Object.entries(candidates)) {
+        result[role] = [];
+        for (const selector of selectors) {
+            const m = selector.match(/^(.*):has-text\\("(.*)"\\)$/);
+            const css = m ? m[1] : selector;
+            let elements;
+            try {
+                elements = Array.from(document.querySelectorAll(css));
+            } catch (e) {
+                continue;
+            }
+            if (m) {
+                elements = elements.filter(el => (el.textContent || '').includes(m[2]));
+            }
+            if (elements.length > 0) {
+                result[role].push(selector);
+            }
+        }
+    }
+    return result;
+}
+"""
+
+class SelectorMap:
+    """Resolves page elements via a single-roundtrip probe, cached on disk per page build."""
+
+    def __init__(self, page, cache_path=SELECTOR_CACHE_PATH):
+        self.page = page
+        self.cache_path = cache_path
+        self.cache = {}
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    self.cache = json.load(f)
+            except (OSError, ValueError):
+                self.cache = {}
+        self.build = page.evaluate(BUILD_KEY_JS)
+        self.resolved = {}
+        # 本次运行中取自磁盘缓存（尚未验证）的角色，失效时可重新探测一次
+        self._from_cache = set()
+
+    def resolve(self, roles):
+        """Return {role: [matching selectors]} for `roles`, probing only roles not in the cache."""
+        cached = self.cache.get(self.build, {}).get("selectors", {})
+        missing = [r for r in roles if r not in self.resolved and r not in cached]
+        for role in roles:
+            if role not in self.resolved and role in cached:
+                self.resolved[role] = [cached[role]]
+                self._from_cache.add(role)
+
+        if missing:
+            print(f"   🔎 探测选择器: {', '.join(missing)}")
+            matches = self.page.evaluate(PROBE_SELECTORS_JS, {r: SELECTOR_CANDIDATES[r] for r in missing})
+            for role in missing:
+                self.resolved[role] = matches.get(role, [])
+            self._save({r: self.resolved[r][0] for r in missing if self.resolved[r]})
+
+        return {r: self.resolved[r] for r in roles}
+
+    def locator(self, role):
+        """First matching element for `role`, or None when nothing matched; a cached selector
+        that no longer matches anything is re-probed once."""
+        selectors = self.resolve([role])[role]
+        if selectors and role in self._from_cache and self.page.locator(selectors[0]).count() == 0:
+            return self.refresh(role)
+        return self.page.locator(selectors[0]).first if selectors else None
+
+    def refresh(self, role):
+        """Re-probe a role whose cached selector failed. Returns the new locator, or None when the
+        selector was already probed this run (nothing new to try) or the probe found nothing."""
+        if role not in self._from_cache:
+            return None
+        print(f"   ♻️  缓存的选择器已失效，重新探测: {role}")
+        self.invalidate(role)
+        selectors = self.resolve([role])[role]
+        return self.page.locator(selectors[0]).first if selectors else None
+
+    def fill(self, role, value):
+        """Fill the first matching element that accepts input; re-probe once if a cached selector went stale."""
+        for _ in range(2):
+            for selector in self.resolve([role])[role]:
+                try:
+                    self.page.locator(selector).first.fill(value, timeout=5000)
+                    return True
+                except Exception:
+                    continue
+            from_cache = role in self._from_cache
+            if from_cache:
+                print(f"   ♻️  缓存的选择器已失效，重新探测: {role}")
+            self.invalidate(role)
+            if not from_cache:
+                break
+        return False
+
+    def invalidate(self, role):
+        """Drop a cached selector that turned out stale so the next resolve re-probes it."""
+        self.resolved.pop(role, None)
+        self._from_cache.discard(role)
+        entry = self.cache.get(self.build)
+        if entry and entry.get("selectors", {}).pop(role, None) is not None:
+            self._save({})
+
+    def _save(self, winners):
+        entry = self.cache.setdefault(self.build, {"selectors": {}})
+        entry["selectors"].update(winners)
+        entry["updated"] = time.time()
+        # 只保留最近的几个页面版本
+        builds = sorted(self.cache, key=lambda b: self.cache[b].get("updated", 0), reverse=True)
+        self.cache = {b: self.cache[b] for b in builds[:SELECTOR_CACHE_MAX_BUILDS]}
+        try:
+            with open(self.cache_path, "w", encoding="utf-8") as f:
+                json.dump(self.cache, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            print(f"   选择器缓存保存失败: {e}")
+
+# 会话模式：storage（默认，storage_state 快照 + 非持久化上下文）或 profile（持久化浏览器目录）
+SESSION_MODE = os.getenv("XHS_SESSION_MODE", "storage").lower()
+# 仅包含小红书域名 cookies/localStorage 的会话快照
+STORAGE_STATE_PATH = os.path.join(os.path.dirname(__file__), ".xhs_storage_state.json")
+SESSION_DOMAIN = "xiaohongshu.com"
+# 校验登录态的轻量接口（已登录时返回用户信息）
+SESSION_PROBE_URL = os.getenv("XHS_SESSION_PROBE_URL", "https://creator.xiaohongshu.com/api/galaxy/user/info")
+# 每次启动的耗时与会话占用空间，便于对比两种模式
+SESSION_METRICS_PATH = os.path.join(os.path.dirname(__file__), ".session_metrics.jsonl")
+
+BROWSER_ARGS = ["--disable-blink-features=AutomationControlled"] # 尝试规避检测
+CONTEXT_OPTIONS = {"viewport": {"width": 1280, "height": 900}, "locale": "zh-CN"}
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def scope_storage_state(state):
+    """Keep only xiaohongshu cookies and localStorage origins."""
+    return {
+        "cookies": [c for c in state.get("cookies", []) if c.get("domain", "").lstrip(".").endswith(SESSION_DOMAIN)],
+        "origins": [o for o in state.get("origins", []) if SESSION_DOMAIN in o.get("origin", "")],
+    }
+
+def load_storage_state():
+    """Load the session snapshot from disk, or from COOKIES_JSON (cookie list or storage_state) on CI."""
+    if os.path.exists(STORAGE_STATE_PATH):
+        try:
+            with open(STORAGE_STATE_PATH, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            # 快照损坏时退回 COOKIES_JSON / 重新登录，下次登录后会覆盖写入
+            print(f"❌ 会话快照读取失败: {e}")
+    cookies_json = os.environ.get("COOKIES_JSON")
+    if cookies_json:
+        try:
+            state = json.loads(cookies_json)
+            print("🍪 检测到 cookies 环境变量，正在加载会话...")
+            if isinstance(state, list):
+                state = {"cookies": state, "origins": []}
+            return scope_storage_state(state)
+        except Exception as e:
+            print(f"❌ Cookies 解析失败: {e}")
+    return None
+
+def save_storage_state(context, is_github_actions):
+    state = scope_storage_state(context.storage_state())
+    tmp_path = STORAGE_STATE_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, STORAGE_STATE_PATH)
+    print(f"\n🍪 会话已保存到 {STORAGE_STATE_PATH} ({_path_size(STORAGE_STATE_PATH) / 1024:.1f} KB)")
+    if not is_github_actions:
+        print("   请复制此文件内容到 GitHub Secrets (Name: COOKIES_JSON)")
+
+def session_is_valid(context):
+    """Cheap authenticated API call instead of loading the creator page to check the login."""
+    try:
+        response = context.request.get(SESSION_PROBE_URL, timeout=10000)
+        if not response.ok:
+            return False
+        body = response.json()
+        return body.get("success") is True or body.get("code") == 0
+    except Exception:
+        return False
+
+def _record_session_metrics(mode, startup_seconds, footprint_bytes):
+    print(f"⏱️  上下文启动 {startup_seconds:.2f}s | 会话占用 {footprint_bytes / 1024:.1f} KB ({mode})")
+    try:
+        with open(SESSION_METRICS_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "mode": mode,
+                "startup_seconds": round(startup_seconds, 3),
+                "footprint_bytes": footprint_bytes,
+            }) + "\n")
+    except OSError:
+        pass
+
+def open_session(p, headless):
+    """Launch the browser in the configured session mode and return the session dict."""
+    started = time.time()
+    session = {"mode": SESSION_MODE, "browser": None, "valid": False, "authenticated": False}
+
+    if SESSION_MODE == "profile":
+        # 使用持久化上下文，保存登录状态
+        os.makedirs(USER_DATA_DIR, exist_ok=True)
+        context = p.chromium.launch_persistent_context(
+            user_data_dir=USER_DATA_DIR,
+            headless=headless,
+            args=BROWSER_ARGS,
+            **CONTEXT_OPTIONS
+        )
+        page = context.pages[0] if context.pages else context.new_page()
+
+        # 尝试从环境变量加载 Cookies (用于 GitHub Actions)
+        cookies_json = os.environ.get("COOKIES_JSON")
+        if cookies_json:
+            try:
+                print("🍪 检测到 cookies 环境变量，正在注入...")
+                cookies = json.loads(cookies_json)
+                if isinstance(cookies, dict):
+                    cookies = cookies.get("cookies", [])
+                context.add_cookies(cookies)
+                print("   Cookies 注入成功")
+            except Exception as e:
+                print(f"❌ Cookies 注入失败: {e}")
+        footprint = _path_size(USER_DATA_DIR)
+    else:
+        browser = p.chromium.launch(headless=headless, args=BROWSER_ARGS)
+        state = load_storage_state()
+        context = browser.new_context(storage_state=state, **CONTEXT_OPTIONS)
+        page = context.new_page()
+        session["browser"] = browser
+        footprint = len(json.dumps(state)) if state else 0
+
+    # 应用 stealth 模式
+    if stealth_sync:
+        stealth_sync(page)
+
+    _record_session_metrics(SESSION_MODE, time.time() - started, footprint)
+
+    if SESSION_MODE != "profile" and state is not None:
+        session["valid"] = session_is_valid(context)
+        print("✅ 会话有效" if session["valid"] else "⚠️  会话已过期，需要重新登录")
+
+    session["context"] = context
+    session["page"] = page
+    return session
+
+def close_session(session, is_github_actions):
+    context = session["context"]
+    if session["mode"] == "profile":
+        # 如果是本地运行，保存 cookies 方便导出到 GitHub
+        if not is_github_actions:
+            try:
+                cookies = context.cookies()
+                with open("xhs_cookies.json", "w", encoding="utf-8") as f:
+                    json.dump(cookies, f, indent=2)
+                print(f"\n🍪 Cookies 已保存到 {os.path.abspath('xhs_cookies.json')}")
+                print("   请复制此文件内容到 GitHub Secrets (Name: COOKIES_JSON)")
+            except Exception as e:
+                print(f"   Cookies 保存失败: {e}")
+    elif session["authenticated"] and not session["valid"]:
+        # 只在会话过期、重新登录后刷新快照
+        try:
+            save_storage_state(context, is_github_actions)
+        except Exception as e:
+            print(f"   会话保存失败: {e}")
+
+    context.close()
+    if session["browser"] is not None:
+        session["browser"].close()
+
+# 发布接口（创作者中心点击发布后调用），可通过环境变量覆盖
+PUBLISH_API_PATTERN = os.getenv("XHS_PUBLISH_API_PATTERN", "/web_api/sns/v2/note")
+# 等待发布接口响应的超时（毫秒）
+PUBLISH_RESPONSE_TIMEOUT = int(os.getenv("XHS_PUBLISH_RESPONSE_TIMEOUT", "15000"))
+
+def _is_publish_response(response):
+    return response.request.method == "POST" and PUBLISH_API_PATTERN in response.url
+
+def parse_publish_response(response):
+    """Turn the publish API response into a structured result."""
+    result = {
+        "status": "failed",
+        "detected_by": "response",
+        "http_status": response.status,
+        "url": response.url,
+    }
+    try:
+        body = response.json()
+    except Exception:
+        result["message"] = "non-JSON response"
+        return result
+
+    data = body.get("data") or {}
+    result["api_code"] = body.get("code")
+    result["message"] = body.get("msg") or body.get("message")
+    result["note_id"] = data.get("id") or data.get("note_id") if isinstance(data, dict) else None
+    if response.ok and (body.get("success") is True or body.get("code") == 0):
+        result["status"] = "success"
+    return result
+
+def _slider_visible(page):
+    return page.locator('.nc_scale, .slider-container, #nc_1_n1z').first.is_visible()
+
+def _drag_slider(page):
+    """Drag the slider captcha handle to the end of its track."""
+    print("⚠️  检测到滑块验证码！尝试自动滑动...")
+    slider_handle = page.locator('#nc_1_n1z, .nc_iconfont.btn_slide').first
+    box = slider_handle.bounding_box() if slider_handle.is_visible() else None
+    if box:
+        page.mouse.move(box["x"] + box["width"] / 2, box["y"] + box["height"] / 2)
+        page.mouse.down()
+        page.mouse.move(box["x"] + 500, box["y"] + box["height"] / 2, steps=20)
+        page.mouse.up()
+
+def _dom_published(page):
+    """Cheap DOM/URL fallback for when the publish API pattern no longer matches."""
+    if "manage" in page.url or "success" in page.url:
+        return "navigation"
+    if page.locator('text=发布成功').count() > 0 or page.locator('text=已发布').count() > 0:
+        return "dom"
+    return None
+
+def click_and_confirm_publish(page, submit_btn, attempts=3):
+    """Click publish and decide the outcome from the publish API response, falling back to
+    DOM success signals; the slider captcha is handled as soon as it shows up."""
+    started = time.time()
+    result = {"status": "unknown", "detected_by": None, "message": "no publish response"}
+    responses = []
+    on_response = lambda response: responses.append(response) if _is_publish_response(response) else None
+    page.on("response", on_response)
+
+    try:
+        for attempt in range(attempts):
+            print(f"   点击发布按钮 (尝试 {attempt+1})...")
+            try:
+                submit_btn.click()
+            except:
+                # 可能是被滑块遮挡，尝试 force=True
+                submit_btn.click(force=True)
+
+            # 轮询：接口响应优先，其次滑块，再次页面跳转/成功提示
+            deadline = time.time() + PUBLISH_RESPONSE_TIMEOUT / 1000
+            slid = False
+            while time.time() < deadline:
+                page.wait_for_timeout(500)  # 让监听器处理事件
+                if responses:
+                    result = parse_publish_response(responses[-1])
+                    break
+                if not slid and _slider_visible(page):
+                    # 滑动后被拦截的请求会继续发出，重新计时
+                    _drag_slider(page)
+                    slid = True
+                    deadline = time.time() + PUBLISH_RESPONSE_TIMEOUT / 1000
+                    continue
+                detected = _dom_published(page)
+                if detected:
+                    result = {"status": "success", "detected_by": detected, "url": page.url}
+                    break
+            if result["detected_by"]:
+                break
+
+            # 再次点击前确认没有已经发布成功（避免重复发布）
+            detected = _dom_published(page)
+            if detected:
+                result = {"status": "success", "detected_by": detected, "url": page.url}
+                break
+            if not submit_btn.is_visible():
+                break
+            print("   未收到发布响应，准备重试...")
+    finally:
+        page.remove_listener("response", on_response)
+
+    result["elapsed_seconds"] = time.time() - started
+    return result
+
+def save_publish_result(work_dir, result):
+    result = dict(result, published_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+    with open(os.path.join(work_dir, "publish_result.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+def publish_to_xhs(paint=False):
+    """使用 Playwright 浏览器自动化发布到小红书
+
+    paint=True 时边生成边上传：图片在后台线程生成，浏览器启动和登录与生成并行，
+    每张图片写入并校验后立即按 prompt 顺序上传。
+    """
     
     # 获取最新内容
     if not os.path.exists("content"):
@@ -39,13 +493,28 @@ def publish_to_xhs():
         data = json.load(f)
     
     # 准备图片
-    image_paths = []
-    for i in range(1, 7):
-        p = os.path.join(work_dir, f"{i}.png")
-        if os.path.exists(p):
-            image_paths.append(os.path.abspath(p))
+    if paint:
+        from painter import paint_stream
+        image_count = len(data.get("image_prompts", []))
+        image_paths = paint_stream(work_dir, data.get("image_prompts", []))
+    else:
+        image_paths = []
+        for i in range(1, 7):
+            p = os.path.join(work_dir, f"{i}.png")
+            if os.path.exists(p):
+                image_paths.append(os.path.abspath(p))
+        image_count = len(image_paths)
     
-    if not image_paths:
+    try:
+        _publish(work_dir, data, image_paths, image_count, paint)
+    finally:
+        if paint:
+            # Never drop the producer mid-generation: paid images, crops and meta.json are finished first
+            image_paths.join()
+
+def _publish(work_dir, data, image_paths, image_count, paint):
+    """Open the browser session, upload `image_paths`, fill in the note and publish it."""
+    if not image_count:
         print("❌ No images found to publish.")
         return
     
@@ -53,46 +522,21 @@ def publish_to_xhs():
     print("小红书 Playwright 发布工具")
     print("=" * 50)
     print(f"\n📝 标题: {data['title']}")
-    print(f"🖼️  图片: {len(image_paths)} 张")
+    print(f"🖼️  图片: {image_count} 张{'（边生成边上传）' if paint else ''}")
     print("=" * 50)
     
     # 检查是否在 GitHub Actions 运行
     is_github_actions = os.environ.get("GITHUB_ACTIONS") == "true"
     
     with sync_playwright() as p:
-        # 使用持久化上下文，保存登录状态
-        os.makedirs(USER_DATA_DIR, exist_ok=True)
-        
         # 如果是 GitHub Actions，必须使用 headless=True
         # 如果是本地，默认 False 以便调试
         headless_mode = is_github_actions
         
-        print(f"🚀 启动浏览器 (Headless: {headless_mode})...")
-        
-        browser = p.chromium.launch_persistent_context(
-            user_data_dir=USER_DATA_DIR,
-            headless=headless_mode,
-            viewport={"width": 1280, "height": 900},
-            locale="zh-CN",
-            args=["--disable-blink-features=AutomationControlled"] # 尝试规避检测
-        )
+        print(f"🚀 启动浏览器 (Headless: {headless_mode}, Session: {SESSION_MODE})...")
         
-        page = browser.pages[0] if browser.pages else browser.new_page()
-        
-        # 应用 stealth 模式
-        if stealth_sync:
-            stealth_sync(page)
-            
-        # 尝试从环境变量加载 Cookies (用于 GitHub Actions)
-        cookies_json = os.environ.get("COOKIES_JSON")
-        if cookies_json:
-            try:
-                print("🍪 检测到 cookies 环境变量，正在注入...")
-                cookies = json.loads(cookies_json)
-                browser.add_cookies(cookies)
-                print("   Cookies 注入成功")
-            except Exception as e:
-                print(f"❌ Cookies 注入失败: {e}")
+        session = open_session(p, headless_mode)
+        page = session["page"]
         
         try:
             # 访问创作者中心
@@ -107,212 +551,115 @@ def publish_to_xhs():
                 # 等待用户登录，最多等待5分钟
                 page.wait_for_url("**/publish/**", timeout=300000)
                 print("✅ 登录成功！")
+            session["authenticated"] = True
             
             time.sleep(2)  # 等待页面稳定
             
+            selectors = SelectorMap(page)
+            
             # 上传图片
             print("\n📤 正在上传图片...")
             
             # 先点击"上传图文"选项卡（如果有的话）
             try:
-                image_tab = page.locator('text=发布图文, text=图文, [class*="image"]').first
-                if image_tab.count() > 0:
-                    image_tab.click()
+                image_tab = selectors.locator("image_tab")
+                if image_tab is not None:
+                    image_tab.click(timeout=5000)
                     time.sleep(1)
             except:
-                pass
+                selectors.invalidate("image_tab")
             
             # 找到图片上传input（排除视频上传的input）
-            # 图片input通常接受 image/* 或 .jpg,.png,.gif 等
-            file_inputs = page.locator('input[type="file"]').all()
-            
-            image_input = None
-            for inp in file_inputs:
-                accept = inp.get_attribute("accept") or ""
-                # 寻找接受图片的input
-                if "image" in accept.lower() or ".jpg" in accept.lower() or ".png" in accept.lower() or ".jpeg" in accept.lower():
-                    # 检查是否支持多文件
-                    multiple = inp.get_attribute("multiple")
-                    image_input = inp
-                    break
-            
-            if image_input is None:
-                # 如果没找到明确的图片input，尝试找带有multiple属性的
-                for inp in file_inputs:
-                    multiple = inp.get_attribute("multiple")
-                    accept = inp.get_attribute("accept") or ""
-                    # 排除视频格式
-                    if ".mp4" not in accept and ".mov" not in accept:
-                        image_input = inp
-                        break
+            image_input = selectors.locator("image_input")
             
+            uploaded = 0
             if image_input is None:
                 print("⚠️  未找到图片上传按钮，请手动上传图片")
-                print(f"   图片路径: {image_paths}")
+                print(f"   图片目录: {os.path.abspath(work_dir)}")
             else:
                 # 逐个上传图片（有些网站不支持多文件一次上传）
+                # 边生成边上传时，迭代会阻塞到下一张图片生成并校验完成
                 for i, img_path in enumerate(image_paths):
+                    print(f"   上传图片 {i+1}/{image_count}...")
                     try:
-                        print(f"   上传图片 {i+1}/{len(image_paths)}...")
-                        image_input.set_input_files(img_path)
-                        time.sleep(2)  # 等待每张图片上传
+                        image_input.set_input_files(img_path, timeout=10000)
                     except Exception as e:
-                        print(f"   图片 {i+1} 上传失败: {e}")
+                        # 缓存的选择器可能已失效：重新探测一次后重试
+                        fresh = selectors.refresh("image_input")
+                        if fresh is None:
+                            print(f"   图片 {i+1} 上传失败: {e}")
+                            continue
+                        image_input = fresh
+                        try:
+                            image_input.set_input_files(img_path, timeout=10000)
+                        except Exception as e:
+                            print(f"   图片 {i+1} 上传失败: {e}")
+                            continue
+                    uploaded += 1
+                    time.sleep(2)  # 等待每张图片上传
+            
+            if paint and uploaded == 0:
+                print("❌ 没有可上传的图片，放弃发布")
+                return
             
             # 等待图片上传完成
             print("   等待图片处理...")
             time.sleep(5)  # 给上传一些时间
             
+            # 标题/正文/发布按钮在图片上传后才出现，一次探测
+            selectors.resolve(["title", "desc", "submit"])
+            
             # 填写标题
             print("📝 正在填写标题...")
-            title_input = page.locator('input[placeholder*="标题"], input[class*="title"], #title').first
-            if title_input.count() > 0:
-                title_input.fill(data['title'][:20])  # 标题限制20字
-            else:
-                # 尝试其他选择器
-                title_input = page.locator('[class*="title"] input, [data-testid="title"]').first
-                if title_input.count() > 0:
-                    title_input.fill(data['title'][:20])
+            filled = selectors.fill("title", data['title'][:20])  # 标题限制20字
+            if not filled:
+                print("⚠️  未能填写标题")
             
             # 填写正文
             print("📝 正在填写正文...")
             desc_text = data['content'] + "\n\n" + " ".join(data['tags'])
             
-            # 尝试多种正文输入选择器
-            desc_selectors = [
-                '[placeholder*="正文"]',
-                '[placeholder*="描述"]',
-                '[class*="content"] textarea',
-                '[class*="desc"] textarea',
-                '#post-textarea',
-                '[contenteditable="true"]'
-            ]
-            
-            for selector in desc_selectors:
-                desc_input = page.locator(selector).first
-                if desc_input.count() > 0:
-                    try:
-                        desc_input.fill(desc_text[:1000])  # 正文限制1000字
-                        break
-                    except:
-                        continue
+            if not selectors.fill("desc", desc_text[:1000]):  # 正文限制1000字
+                print("⚠️  未能填写正文")
+                filled = False
             
-            print("✅ 内容填写完成！")
-
-            # 自动点击发布
-            print("\n🚀 正在自动点击发布...")
-            submit_btn = page.locator('button.submit, button:has-text("发布"), .publish-btn').first
-            
-            if submit_btn.count() > 0:
-                # 点击发布按钮的循环，最多尝试3次
-                for attempt in range(3):
-                    print(f"   点击发布按钮 (尝试 {attempt+1})...")
-                    try:
-                        submit_btn.click()
-                    except:
-                        # 可能是被滑块遮挡，尝试 force=True
-                        submit_btn.click(force=True)
-                    
-                    # 检测是否出现验证码（滑块）
-                    time.sleep(2)
-                    
-                    # 检查滑块
-                    slider = page.locator('.nc_scale, .slider-container, #nc_1_n1z').first
-                    if slider.count() > 0 and slider.is_visible():
-                        print("⚠️  检测到滑块验证码！尝试自动滑动...")
-                        slider_handle = page.locator('#nc_1_n1z, .nc_iconfont.btn_slide').first
-                        if slider_handle.count() > 0:
-                            box = slider_handle.bounding_box()
-                            if box:
-                                page.mouse.move(box["x"] + box["width"] / 2, box["y"] + box["height"] / 2)
-                                page.mouse.down()
-                                page.mouse.move(box["x"] + 500, box["y"] + box["height"] / 2, steps=20)
-                                page.mouse.up()
-                                time.sleep(2)
-                    
-                    # 检查是否已经跳转或成功，如果是则退出点击循环
-                    if "manage" in page.url or "success" in page.url:
-                        break
-                    if page.locator('text=发布成功').count() > 0 or \
-                       page.locator('text=已发布').count() > 0:
-                        break
-                    
-                    # 如果按钮还在且可见，说明点击可能没生效，继续循环
-                    if not submit_btn.is_visible():
-                        break
-                        
-                    print("   似乎未跳转，准备重试...")
-                    time.sleep(2)
+            if not filled:
+                # 标题/正文为空时不自动发布，避免发出空笔记
+                print("❌ 内容未填写完整，跳过自动发布，请手动检查")
+                result = {"status": "unknown", "detected_by": None, "message": "title/desc not filled"}
             else:
-                print("❌ 未找到发布按钮，请手动点击")
+                print("✅ 内容填写完成！")
 
-            # 等待发布成功提示
-            try:
-                print("   等待发布成功确认...")
+                # 自动点击发布
+                print("\n🚀 正在自动点击发布...")
+                submit_btn = selectors.locator("submit")
                 
-                # 轮询检查
-                start_time = time.time()
-                success = False
-                while time.time() - start_time < 15:
-                    # 检查 URL 是否包含 success 或 manage
-                    if "manage" in page.url or "success" in page.url:
-                        print("   检测到页面跳转，发布可能成功")
-                        success = True
-                        break
-                    
-                    # 检查是否有成功提示元素
-                    # 可以根据实际情况添加更多关键词
-                    if page.locator('text=发布成功').count() > 0 or \
-                       page.locator('text=已发布').count() > 0 or \
-                       page.locator('div[class*="success"]').count() > 0:
-                        print("   检测到成功提示")
-                        success = True
-                        break
-                    
-                    time.sleep(0.5)
-                
-                if success:
-                    print("🎉 发布成功！")
+                if submit_btn is not None:
+                    result = click_and_confirm_publish(page, submit_btn)
                 else:
-                    raise Exception("Timeout waiting for success signal")
+                    print("❌ 未找到发布按钮，请手动点击")
+                    result = {"status": "unknown", "detected_by": None, "message": "submit button not found"}
 
-            except Exception as e:
-                print(f"⚠️  未检测到明确的发布成功信号: {e}")
+            save_publish_result(work_dir, result)
+            
+            if result["status"] == "success":
+                print(f"🎉 发布成功！笔记ID: {result.get('note_id') or '未知'} ({result['elapsed_seconds']:.1f}s)")
+            else:
+                print(f"⚠️  未确认发布成功: {result.get('message')}")
                 # 截图以供调试
                 screenshot_path = os.path.join(work_dir, "publish_status_debug.png")
                 page.screenshot(path=screenshot_path)
                 print(f"   已保存页面截图到: {screenshot_path}")
                 print("   请手动检查浏览器状态")
             
-            # 只有在出错或未确认成功时才暂停，否则直接退出
-            if page.locator('text=发布成功').count() == 0:
-                print("\n按 Enter 键关闭浏览器...")
-                # give user a chance to see what happened if not successful
-                # input() 
-                # To make it fully automated, we might remove input() but keep a short sleep
-                time.sleep(5)
-            else:
-                time.sleep(3) # Show success for a moment
-            
         except Exception as e:
             print(f"\n❌ 发布失败: {e}")
             if not is_github_actions:
                 time.sleep(5)
         
         finally:
-            # 如果是本地运行，保存 cookies 方便导出到 GitHub
-            if not is_github_actions:
-                try:
-                    cookies = browser.cookies()
-                    with open("xhs_cookies.json", "w", encoding="utf-8") as f:
-                        json.dump(cookies, f, indent=2)
-                    print(f"\n🍪 Cookies 已保存到 {os.path.abspath('xhs_cookies.json')}")
-                    print("   请复制此文件内容到 GitHub Secrets (Name: COOKIES_JSON)")
-                except Exception as e:
-                    print(f"   Cookies 保存失败: {e}")
-            
-            browser.close()
+            close_session(session, is_github_actions)
             print("\n👋 浏览器已关闭")
 
 if __name__ == "__main__":
-    publish_to_xhs()
+    publish_to_xhs(paint="--paint" in sys.argv)
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+# fcntl is POSIX only; on Windows we fall back to unlocked access
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+load_dotenv()
+
+# 调度器状态（各 provider 的请求/Token 使用记录），跨运行持久化
+STATE_PATH = os.getenv("SCHEDULER_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".scheduler_state.json"))
+
+MINUTE = 60
+DAY = 24 * 60 * 60
+
+# 默认配额（None 表示不限制），可通过环境变量 SCHEDULER_LIMITS 覆盖，例如：
+# SCHEDULER_LIMITS='{"text:gemini": {"rpm": 10, "rpd": 500}}'
+DEFAULT_LIMITS = {
+    "text:gemini": {"rpm": 5, "rpd": 100, "tpm": 250000},
+    "text:doubao": {"rpm": 60, "rpd": None, "tpm": 1000000},
+    "text:dashscope": {"rpm": 60, "rpd": None, "tpm": 1000000},
+    "image:gemini": {"rpm": 10, "rpd": 500, "tpm": None},
+    "image:openai": {"rpm": 10, "rpd": 500, "tpm": None},
+    "image:doubao": {"rpm": 60, "rpd": None, "tpm": None},
+    "image:dashscope": {"rpm": 30, "rpd": None, "tpm": None},
+}
+
+# 若所有 provider 都需要等待超过该时长（秒），直接放弃而不是阻塞
+MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_MAX_WAIT", "600"))
+
+# 每个 provider 对应的 API Key 环境变量，用于过滤未配置的 provider
+PROVIDER_KEYS = {
+    "gemini": "GEMINI_API_KEY",
+    "openai": "GEMINI_API_KEY",
+    "doubao": "ARK_API_KEY",
+    "dashscope": "DASHSCOPE_API_KEY",
+}
+
+class QuotaExhausted(Exception):
+    """Raised when no candidate provider has headroom within MAX_WAIT_SECONDS."""
+
+def load_limits():
+    limits = {k: dict(v) for k, v in DEFAULT_LIMITS.items()}
+    override = os.getenv("SCHEDULER_LIMITS")
+    if override:
+        try:
+            for key, value in json.loads(override).items():
+                limits.setdefault(key, {"rpm": None, "rpd": None, "tpm": None}).update(value)
+        except Exception as e:
+            print(f"⚠️  Invalid SCHEDULER_LIMITS, using defaults: {e}")
+    return limits
+
+def configured_providers(kind):
+    """Providers configured for `kind` ("text"/"image") in preference order, whether or not
+    their API keys are set.
+
+    TEXT_LLM_PROVIDERS / IMAGE_LLM_PROVIDERS take a comma-separated list; otherwise
+    the single TEXT_LLM_PROVIDER / IMAGE_LLM_PROVIDER is used.
+    """
+    prefix = kind.upper()
+    default = os.getenv(f"{prefix}_LLM_PROVIDER", "gemini")
+    return [p.strip().lower() for p in os.getenv(f"{prefix}_LLM_PROVIDERS", default).split(",") if p.strip()]
+
+def candidate_providers(kind):
+    """Configured providers to route `kind` work to; providers without an API key are dropped."""
+    names = configured_providers(kind)
+    available = [p for p in names if os.getenv(PROVIDER_KEYS.get(p, ""), "")]
+    return available or names[:1]
+
+def is_rate_limited(exc):
+    """Best-effort detection of a 429 from openai, genai, requests or a tenacity RetryError."""
+    last_attempt = getattr(exc, "last_attempt", None)
+    if last_attempt is not None and last_attempt.exception() is not None:
+        exc = last_attempt.exception()
+    if getattr(exc, "status_code", None) == 429 or getattr(exc, "code", None) == 429:
+        return True
+    text = str(exc)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "rate limit" in text.lower()
+
+class RequestScheduler:
+    """Admits requests against per-provider RPM/RPD/TPM budgets persisted on disk.
+
+    State is re-read under a file lock on every admission so several processes
+    (planner, painter workers) share the same budget.
+    """
+
+    def __init__(self, state_path=STATE_PATH, limits=None):
+        self.state_path = state_path
+        self.limits = limits or load_limits()
+
+    @contextmanager
+    def _locked_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        with open(self.state_path + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = {}
+                if os.path.exists(self.state_path):
+                    try:
+                        with open(self.state_path, "r", encoding="utf-8") as f:
+                            state = json.load(f)
+                    except (OSError, ValueError):
+                        state = {}
+                yield state
+                self._prune(state, time.time())
+                tmp_path = self.state_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _prune(state, now):
+        for entry in state.values():
+            entry["requests"] = [t for t in entry.get("requests", []) if now - t < DAY]
+            entry["tokens"] = [[t, n] for t, n in entry.get("tokens", []) if now - t < MINUTE]
+
+    def _limit(self, key, name):
+        return self.limits.get(key, {}).get(name)
+
+    def _wait_for(self, state, key, tokens, now):
+        """Seconds until `key` can take one more request of `tokens` tokens (0 = now)."""
+        entry = state.get(key, {})
+        waits = [max(0.0, entry.get("blocked_until", 0) - now)]
+        requests = sorted(t for t in entry.get("requests", []) if now - t < DAY)
+
+        rpm = self._limit(key, "rpm")
+        recent = [t for t in requests if now - t < MINUTE]
+        if rpm and len(recent) >= rpm:
+            waits.append(recent[len(recent) - rpm] + MINUTE - now)
+
+        rpd = self._limit(key, "rpd")
+        if rpd and len(requests) >= rpd:
+            waits.append(requests[len(requests) - rpd] + DAY - now)
+
+        tpm = self._limit(key, "tpm")
+        if tpm and tokens:
+            window = sorted((t, n) for t, n in entry.get("tokens", []) if now - t < MINUTE)
+            used = sum(n for _, n in window)
+            for t, n in window:
+                if used + tokens <= tpm:
+                    break
+                used -= n
+                waits.append(t + MINUTE - now)
+
+        return max(waits)
+
+    def _headroom(self, state, key, now):
+        """Fraction of the per-minute request budget still free, used to rank ready providers."""
+        rpm = self._limit(key, "rpm")
+        if not rpm:
+            return 1.0
+        recent = [t for t in state.get(key, {}).get("requests", []) if now - t < MINUTE]
+        return 1.0 - len(recent) / rpm
+
+    def choose(self, kind, providers, tokens=0):
+        """Pick the provider that can serve soonest (ties broken by headroom) without reserving."""
+        with self._locked_state() as state:
+            now = time.time()
+            ranked = sorted(
+                providers,
+                key=lambda p: (self._wait_for(state, f"{kind}:{p}", tokens, now), -self._headroom(state, f"{kind}:{p}", now))
+            )
+        return ranked[0]
+
+    def acquire(self, kind, providers, tokens=0):
+        """Block until one of `providers` has budget, reserve a request slot on it and return it."""
+        while True:
+            with self._locked_state() as state:
+                now = time.time()
+                waits = {p: self._wait_for(state, f"{kind}:{p}", tokens, now) for p in providers}
+                ready = [p for p in providers if waits[p] <= 0]
+                if ready:
+                    provider = max(ready, key=lambda p: self._headroom(state, f"{kind}:{p}", now))
+                    entry = state.setdefault(f"{kind}:{provider}", {})
+                    entry.setdefault("requests", []).append(now)
+                    if tokens:
+                        entry.setdefault("tokens", []).append([now, tokens])
+                    return provider
+
+            delay = min(waits.values())
+            if delay > MAX_WAIT_SECONDS:
+                raise QuotaExhausted(f"No {kind} provider has quota within {MAX_WAIT_SECONDS:.0f}s: {waits}")
+            print(f"⏳ {kind} quota busy, waiting {delay:.1f}s...")
+            time.sleep(delay)
+
+    def record_tokens(self, kind, provider, tokens, estimated=0):
+        """Correct the reserved token estimate with the actual usage once a call returns."""
+        delta = tokens - estimated
+        if not delta:
+            return
+        with self._locked_state() as state:
+            state.setdefault(f"{kind}:{provider}", {}).setdefault("tokens", []).append([time.time(), delta])
+
+    def penalize(self, kind, provider, seconds=MINUTE):
+        """Back a provider off after a 429 so routing prefers the others meanwhile."""
+        with self._locked_state() as state:
+            entry = state.setdefault(f"{kind}:{provider}", {})
+            entry["blocked_until"] = max(entry.get("blocked_until", 0), time.time() + seconds)
+
+_scheduler = None
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RequestScheduler()
+    return _scheduler
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+import jobqueue
+
+@pytest.fixture
+def queue_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobqueue, "QUEUE_PATH", str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(jobqueue, "LEASE_SECONDS", 60)
+    monkeypatch.setattr(jobqueue, "MAX_ATTEMPTS", 2)
+    work_dir = tmp_path / "2026-01-01"
+    work_dir.mkdir()
+    return work_dir
+
+def expire_leases():
+    with jobqueue._connect() as conn:
+        conn.execute("UPDATE jobs SET lease_until = ?", (time.time() - 1,))
+
+def status(job_id):
+    with jobqueue._connect() as conn:
+        return conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()["status"]
+
+def test_claim_leases_jobs_in_order_once(queue_dir):
+    assert jobqueue.enqueue_prompts(str(queue_dir), ["a", "b"]) == 2
+    first, second = jobqueue.claim("w1"), jobqueue.claim("w2")
+    assert (first["idx"], first["worker"], first["attempts"]) == (1, None, 1)
+    assert second["idx"] == 2
+    assert jobqueue.claim("w3") is None
+    assert jobqueue.counts() == {"running": 2}
+
+def test_enqueue_skips_rendered_images(queue_dir):
+    (queue_dir / "1.png").write_bytes(b"png")
+    assert jobqueue.enqueue_prompts(str(queue_dir), ["a", "b"]) == 1
+    assert jobqueue.claim("w1")["idx"] == 2
+
+def test_upsert_replaces_pending_but_not_running(queue_dir):
+    jobqueue.enqueue_prompts(str(queue_dir), ["a", "b"])
+    running = jobqueue.claim("w1")
+    assert jobqueue.enqueue_prompts(str(queue_dir), ["a2", "b2"]) == 1
+    pending = jobqueue.claim("w2")
+    assert (pending["idx"], pending["prompt"], pending["attempts"]) == (2, "b2", 1)
+    with jobqueue._connect() as conn:
+        assert conn.execute("SELECT prompt FROM jobs WHERE id = ?", (running["id"],)).fetchone()["prompt"] == "a"
+
+def test_heartbeat_extends_lease_until_taken_over(queue_dir):
+    jobqueue.enqueue_prompts(str(queue_dir), ["a"])
+    job = jobqueue.claim("w1")
+    assert jobqueue.heartbeat(job["id"], "w1")
+    assert jobqueue.claim("w2") is None
+    expire_leases()
+    assert jobqueue.counts() == {"pending": 1}
+    assert jobqueue.claim("w2")["attempts"] == 2
+    assert not jobqueue.heartbeat(job["id"], "w1")
+
+def test_expired_job_out_of_attempts_fails(queue_dir):
+    jobqueue.enqueue_prompts(str(queue_dir), ["a"])
+    for worker in ("w1", "w2"):
+        assert jobqueue.claim(worker) is not None
+        expire_leases()
+    assert jobqueue.claim("w3") is None
+    assert jobqueue.counts() == {"failed": 1}
+
+def test_expired_job_with_image_is_handed_out_past_its_attempts(queue_dir):
+    jobqueue.enqueue_prompts(str(queue_dir), ["a"])
+    for worker in ("w1", "w2"):
+        jobqueue.claim(worker)
+        expire_leases()
+    (queue_dir / "1.png").write_bytes(b"png")
+    job = jobqueue.claim("w3")
+    assert job["attempts"] == 3
+    assert jobqueue.complete(job["id"], "w3", {"x": 1}) == {1: {"x": 1}}
+
+def test_fail_retries_then_gives_up(queue_dir):
+    jobqueue.enqueue_prompts(str(queue_dir), ["a"])
+    job = jobqueue.claim("w1")
+    assert jobqueue.fail(job["id"], "w1", "boom") is None
+    assert status(job["id"]) == "pending"
+    job = jobqueue.claim("w1")
+    assert jobqueue.fail(job["id"], "w1", "boom") == {}
+    assert status(job["id"]) == "failed"
+
+def test_fail_with_image_on_disk_counts_as_done(queue_dir):
+    jobqueue.enqueue_prompts(str(queue_dir), ["a"])
+    job = jobqueue.claim("w1")
+    (queue_dir / "1.png").write_bytes(b"png")
+    assert jobqueue.fail(job["id"], "w1", "crop failed") == {}
+    assert status(job["id"]) == "done"
+
+def test_worker_that_lost_its_lease_cannot_finish_the_job(queue_dir):
+    jobqueue.enqueue_prompts(str(queue_dir), ["a"])
+    job = jobqueue.claim("w1")
+    expire_leases()
+    takeover = jobqueue.claim("w2")
+    assert jobqueue.complete(job["id"], "w1", {"x": 1}) is None
+    assert jobqueue.fail(job["id"], "w1", "boom") is None
+    assert status(job["id"]) == "running"
+    assert jobqueue.complete(takeover["id"], "w2", {"x": 2}) == {1: {"x": 2}}
+    # The late finisher must not clobber or re-announce a finished job
+    assert jobqueue.complete(job["id"], "w1", {"x": 1}) is None
@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("pydantic")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLOW_SECONDS = 6
+
+PLAN = {
+    "date": "2026-01-01",
+    "theme": "Summer Rain",
+    "style_name": "Makoto Shinkai Style",
+    "title": "夏日雨天 ☔",
+    "content": "雨后的街道",
+    "tags": ["#动漫", "#壁纸"],
+    "image_prompts": [f"rainy street scene {i} --ar 3:4" for i in range(6)],
+}
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible /chat/completions; paths under /slow/ answer after SLOW_SECONDS."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/slow/"):
+            time.sleep(SLOW_SECONDS)
+        body = json.dumps({
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "fake",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": json.dumps(PLAN)}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+        }).encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client process already exited
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeChatHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def test_hedged_plan_exits_without_waiting_for_slow_loser(fake_server, tmp_path):
+    script = textwrap.dedent(f"""
+        import planner
+        planner.PLAN_LATENCY_PATH = {str(tmp_path / "latency.json")!r}
+        primary = {{"provider": "doubao", "provider_name": "slow", "model": "fake", "api_key": "k",
+                    "base_url": {fake_server + "/slow/v1"!r}}}
+        secondary = {{"provider": "dashscope", "provider_name": "fast", "model": "fake", "api_key": "k",
+                      "base_url": {fake_server + "/fast/v1"!r}}}
+        plan = planner.generate_hedged(primary, [secondary], "prompt", "2026-01-01", planner._new_usage_stats())
+        assert plan is not None and plan["title"] == {PLAN["title"]!r}
+    """)
+    env = dict(
+        os.environ,
+        PLAN_HEDGE_DELAY="0.5",
+        SCHEDULER_STATE_PATH=str(tmp_path / "scheduler.json"),
+        PROVIDER_CASSETTE="off",
+        PROMPT_CACHE="implicit",
+        PYTHONPATH=ROOT,
+    )
+    started = time.monotonic()
+    proc = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60)
+    elapsed = time.monotonic() - started
+
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "hedging to fast" in proc.stdout
+    # The process must not stay alive until the slow primary answers
+    assert elapsed < SLOW_SECONDS - 1, f"planner took {elapsed:.1f}s"
+
+    # The cancelled primary leaves a censored latency sample of at least the hedge delay
+    with open(tmp_path / "latency.json", encoding="utf-8") as f:
+        latencies = json.load(f)
+    assert latencies["doubao"] and min(latencies["doubao"]) >= 0.5